@@ -5,6 +5,7 @@
 #include <Adafruit_GFX.h>
 #include <Adafruit_ST7735.h>
 #include <ArduinoJson.h>
+#include <time.h>
 
 // Pins Configuration
 #define RST_PIN         22
@@ -19,9 +20,11 @@
 const char* ssid = "Esp32";
 const char* password = "harse123";
 const char* serverBaseUrl = "http://127.0.0.1:5000";
-const char* attendanceEndpoint = "/api/attendance";
+const char* tapEndpoint = "/api/tap";
+const char* batchEndpoint = "/api/attendance/batch";
+const char* readerId = "reader-1";
+const char* readerKey = "";  // From `flask add-reader reader-1`
 const char* registerEndpoint = "/register_rfid";
-const char* studentInfoEndpoint = "/api/student_info";
 
 // Display Setup
 Adafruit_ST7735 tft = Adafruit_ST7735(TFT_CS, TFT_DC, TFT_RST);
@@ -29,9 +32,22 @@ MFRC522 rfid(SS_PIN, RST_PIN);
 
 // System Variables
 String currentStudentName = "";
+String currentFirstSeen = "";
+HTTPClient tapHttp;  // Reused across taps so the connection stays open
 unsigned long lastCardReadTime = 0;
 const unsigned long cardReadInterval = 2000;
 
+// Offline Tap Buffer (uploaded in bulk once the server is reachable)
+#define MAX_PENDING_TAPS 64
+struct PendingTap {
+  String uid;
+  time_t timestamp;  // Epoch seconds, 0 if the clock isn't synced yet
+};
+PendingTap pendingTaps[MAX_PENDING_TAPS];
+int pendingCount = 0;
+unsigned long lastFlushAttempt = 0;
+const unsigned long flushInterval = 10000;
+
 void setup() {
   Serial.begin(115200);
 
@@ -46,10 +62,12 @@ void setup() {
   rfid.PCD_Init();
 
   connectToWiFi();
+  configTime(0, 0, "pool.ntp.org");  // Epoch timestamps for buffered taps
   showHomeScreen();
 }
 
 void loop() {
+  flushPendingTaps();
   handleNormalOperation();
   delay(100);
 }
@@ -65,26 +83,30 @@ void handleNormalOperation() {
     String uid = getRfidUid();
     Serial.println("UID:" + uid);
 
-    currentStudentName = getStudentNameFromServer(uid);
-
     tft.fillScreen(ST77XX_BLACK);
     tft.setTextColor(ST77XX_WHITE);
     tft.setTextSize(1);
     tft.setCursor(10, 30);
+    tft.print("Processing...");
 
-    if (currentStudentName != "") {
+    String tapStatus = "";
+    int httpCode = sendTap(uid, tapStatus);
+    if (httpCode == HTTP_CODE_OK) {
+      tft.fillScreen(ST77XX_BLACK);
+      tft.setCursor(10, 30);
       tft.print("Hello, " + currentStudentName);
-    } else {
-      tft.print("Processing...");
-    }
-
-    if (sendAttendance(uid)) {
-      showSuccess("Attendance Recorded");
+      showSuccess(tapStatus == "duplicate" ? "Already Recorded " + currentFirstSeen : "Attendance Recorded");
+      digitalWrite(GREEN_LED, HIGH);
+      delay(100);
+      digitalWrite(GREEN_LED, LOW);
+    } else if (httpCode <= 0 && bufferTap(uid)) {
+      // Server unreachable: keep the tap and upload it with the next batch
+      showSuccess("Saved Offline");
       digitalWrite(GREEN_LED, HIGH);
       delay(100);
       digitalWrite(GREEN_LED, LOW);
     } else {
-      showError(currentStudentName != "" ? "Server Error" : "Not Registered");
+      showError(httpCode == HTTP_CODE_NOT_FOUND ? "Not Registered" : "Server Error");
       digitalWrite(RED_LED, HIGH);
       delay(100);
       digitalWrite(RED_LED, LOW);
@@ -106,54 +128,80 @@ String getRfidUid() {
   return uid;
 }
 
-String getStudentNameFromServer(String uid) {
+// Records the tap and fetches the student's name in one request.
+// Returns the HTTP status code, or a value <= 0 if the server was unreachable.
+int sendTap(String uid, String &status) {
   if (WiFi.status() != WL_CONNECTED) {
     connectToWiFi();
-    if (WiFi.status() != WL_CONNECTED) return "";
+    if (WiFi.status() != WL_CONNECTED) return -1;
   }
 
-  HTTPClient http;
-  String url = String(serverBaseUrl) + String(studentInfoEndpoint) + "?uid=" + uid;
-  http.begin(url);
-
-  int httpCode = http.GET();
-  String name = "";
-
-  if (httpCode == HTTP_CODE_OK) {
-    String payload = http.getString();
-    DynamicJsonDocument doc(256);
-    deserializeJson(doc, payload);
-    name = doc["name"].as<String>();
+  tapHttp.setReuse(true);
+  tapHttp.begin(String(serverBaseUrl) + String(tapEndpoint) + "?format=text");
+  tapHttp.addHeader("Content-Type", "text/plain");
+  tapHttp.addHeader("X-Reader-Key", readerKey);
+
+  int httpCode = tapHttp.POST(uid);
+  currentStudentName = "";
+  currentFirstSeen = "";
+
+  if (httpCode > 0) {
+    // One line: status|name|HH:MM:SS
+    String line = tapHttp.getString();
+    line.trim();
+    int first = line.indexOf('|');
+    int second = line.indexOf('|', first + 1);
+    if (first > 0 && second > first) {
+      status = line.substring(0, first);
+      currentStudentName = line.substring(first + 1, second);
+      currentFirstSeen = line.substring(second + 1);
+    }
   }
 
-  http.end();
-  return name;
+  tapHttp.end();  // Keeps the connection open for the next tap (setReuse)
+  return httpCode;
 }
 
-bool sendAttendance(String uid) {
-  if (WiFi.status() != WL_CONNECTED) {
-    connectToWiFi();
-    if (WiFi.status() != WL_CONNECTED) return false;
-  }
+bool bufferTap(String uid) {
+  if (pendingCount >= MAX_PENDING_TAPS) return false;
 
-  HTTPClient http;
-  String url = String(serverBaseUrl) + String(attendanceEndpoint);
-  http.begin(url);
-  http.addHeader("Content-Type", "application/json");
+  time_t now = time(nullptr);
+  pendingTaps[pendingCount].uid = uid;
+  pendingTaps[pendingCount].timestamp = now > 1000000000 ? now : 0;
+  pendingCount++;
+  return true;
+}
 
-  DynamicJsonDocument doc(128);
-  doc["uid"] = uid;
-  if (currentStudentName != "") {
-    doc["name"] = currentStudentName;
+void flushPendingTaps() {
+  if (pendingCount == 0 || WiFi.status() != WL_CONNECTED) return;
+  if (millis() - lastFlushAttempt < flushInterval) return;
+  lastFlushAttempt = millis();
+
+  DynamicJsonDocument doc(128 + 96 * pendingCount);
+  JsonArray events = doc.createNestedArray("events");
+  for (int i = 0; i < pendingCount; i++) {
+    JsonObject event = events.createNestedObject();
+    event["uid"] = pendingTaps[i].uid;
+    event["reader_id"] = readerId;
+    if (pendingTaps[i].timestamp != 0) {
+      event["timestamp"] = (long)pendingTaps[i].timestamp;
+    }
   }
 
   String payload;
   serializeJson(doc, payload);
 
+  HTTPClient http;
+  http.begin(String(serverBaseUrl) + String(batchEndpoint));
+  http.addHeader("Content-Type", "application/json");
+  http.addHeader("X-Reader-Key", readerKey);
   int httpCode = http.POST(payload);
   http.end();
 
-  return (httpCode == HTTP_CODE_OK);
+  // Every event gets a final per-event result, so the buffer can be cleared
+  if (httpCode == HTTP_CODE_OK) {
+    pendingCount = 0;
+  }
 }
 
 void connectToWiFi() {
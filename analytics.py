@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+def _frame(rows):
+    """Typed columns for a list of attendance rows: categorical UID/status, datetime64 timestamps"""
+    raw = pd.DataFrame.from_records(rows, columns=['UID', 'Name', 'Timestamp', 'Status'])
+    frame = pd.DataFrame({
+        'uid': raw['UID'].astype('category'),
+        'status': raw['Status'].astype('category'),
+        'timestamp': pd.to_datetime(raw['Timestamp'], format='%Y-%m-%d %H:%M:%S', errors='coerce'),
+    })
+    return frame.dropna(subset=['timestamp'])
+
+
+def _daily(frame, late_after):
+    """One row per (uid, date) with a Present tap: first and last tap, and whether the first was late"""
+    present = frame[frame['status'] == 'Present']
+    daily = present.groupby(
+        [present['uid'], present['timestamp'].dt.normalize().rename('date')], observed=True
+    )['timestamp'].agg(first='min', last='max').reset_index()
+    daily['late'] = daily['first'] - daily['date'] > late_after
+    return daily
+
+
+def _combine(parts, late_after):
+    """Regroup daily rows from several parts, which may overlap, into one daily frame"""
+    categories = pd.Index([])
+    for part in parts:
+        categories = categories.append(part['uid'].cat.categories.difference(categories))
+    parts = [part.assign(uid=part['uid'].cat.set_categories(categories)) for part in parts]
+    daily = pd.concat(parts, ignore_index=True).groupby(['uid', 'date'], observed=True).agg(
+        first=('first', 'min'), last=('last', 'max')).reset_index()
+    daily['late'] = daily['first'] - daily['date'] > late_after
+    return daily
+
+
+def _merge(daily, new, late_after):
+    """Fold the daily rows of newly appended taps into daily
+
+    Only the days the new taps fall on are regrouped, so the cost grows
+    with the size of those days rather than with the whole history.
+    """
+    if new.empty:
+        return daily
+    touched = daily['date'].isin(new['date'].unique())
+    merged = _combine([daily[touched], new], late_after)
+    untouched = daily[~touched]
+    untouched = untouched.assign(uid=untouched['uid'].cat.set_categories(merged['uid'].cat.categories))
+    return pd.concat([untouched, merged], ignore_index=True)
+
+
+def _registered(roster, default):
+    """Registration dates of a roster as datetime64, default where missing or malformed"""
+    dates = pd.Series([student['RegisteredDate'] for student in roster], dtype=object)
+    return pd.to_datetime(dates, format='%Y-%m-%d', errors='coerce').fillna(pd.Timestamp(default)).to_numpy()
+
+
+def _runs(matrix):
+    """Length of the run of True ending at each cell, along each row"""
+    counts = matrix.cumsum(axis=1)
+    resets = np.maximum.accumulate(np.where(matrix, 0, counts), axis=1)
+    return counts - resets
+
+
+class AttendanceAnalytics:
+    """Per-student and per-class attendance reports computed with pandas.
+
+    The log is read once, in chunks parsed into typed columns, and reduced
+    to one row per (student, day) with the first and last Present tap.
+    After that it is followed with repository.changes_since(), at most
+    every refresh_interval seconds, and only the days new taps fall on are
+    regrouped. Rows read twice (around the initial load) fold into the
+    same (student, day) row, so they can't skew the figures.
+
+    A class day is a day on which anyone tapped in (the same rule the
+    absence job uses), and a student is only counted from the day they
+    registered.
+    """
+
+    def __init__(self, repository, late_after='09:15', chunk_rows=50000, refresh_interval=5.0):
+        self.repository = repository
+        self.late_after = pd.Timedelta(hours=int(late_after[:2]), minutes=int(late_after[3:5]))
+        self.chunk_rows = chunk_rows
+        self.refresh_interval = refresh_interval
+        self.generation = 0  # Bumped whenever new rows are loaded
+        self._daily = None
+        self._position = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---- Loading ----
+
+    def _load(self):
+        # Take the position first: rows appended during the read are seen twice, never missed
+        _, position = self.repository.changes_since()
+        parts = [_daily(_frame(rows), self.late_after) for rows in self.repository.iter_chunks(self.chunk_rows)]
+        self._daily = _combine(parts or [_daily(_frame([]), self.late_after)], self.late_after)
+        self._position = position
+        self.generation += 1
+
+    def refresh(self, force=False):
+        """Load rows appended since the last refresh (the whole log the first time)"""
+        with self._lock:
+            now = time.monotonic()
+            if self._daily is not None and not force and now - self._refreshed_at < self.refresh_interval:
+                return
+            self._refreshed_at = now
+            if self._daily is None:
+                self._load()
+                return
+            try:
+                rows, self._position = self.repository.changes_since(self._position)
+            except Exception:
+                logger.exception("Following the attendance log failed, reloading it")
+                self._load()
+                return
+            if rows:
+                self._daily = _merge(self._daily, _daily(_frame(rows), self.late_after), self.late_after)
+                self.generation += 1
+
+    def _range(self, start, end, uid=None):
+        self.refresh()
+        daily = self._daily
+        mask = (daily['date'] >= pd.Timestamp(start)) & (daily['date'] <= pd.Timestamp(end))
+        if uid:
+            mask &= daily['uid'] == uid
+        return daily[mask]
+
+    # ---- Reports ----
+
+    def _class_days(self, start, end):
+        return np.sort(self._range(start, end)['date'].unique())
+
+    def students(self, roster, start, end):
+        """Attendance of every student in roster over start..end (inclusive)
+
+        Returns a list, in roster order, of {uid, name, class_days,
+        days_present, percentage, late, current_streak, longest_streak}.
+        Streaks count consecutive class days present.
+        """
+        daily = self._range(start, end)
+        class_days = self._class_days(start, end)
+        uids = [student['UID'] for student in roster]
+
+        # Present/absent matrix: one row per student, one column per class day.
+        # Taps from before a student registered (a reused card, say) don't count.
+        registered = _registered(roster, start)
+        codes = pd.Index(uids).get_indexer(daily['uid'].cat.categories)[daily['uid'].cat.codes.to_numpy()]
+        dates = daily['date'].to_numpy()
+        known = codes >= 0
+        known[known] = dates[known] >= registered[codes[known]]
+        matrix = np.zeros((len(uids), len(class_days)), dtype=np.int32)
+        columns = np.searchsorted(class_days, dates[known])
+        matrix[codes[known], columns] = 1
+
+        eligible = len(class_days) - np.searchsorted(class_days, registered)
+        present = matrix.sum(axis=1)
+        late = np.bincount(codes[known], weights=daily['late'].to_numpy(dtype=float)[known], minlength=len(uids))
+        runs = _runs(matrix) if len(class_days) else np.zeros((len(uids), 1), dtype=np.int32)
+
+        return [
+            {
+                'uid': student['UID'],
+                'name': student['Name'],
+                'class_days': int(eligible[i]),
+                'days_present': int(present[i]),
+                'percentage': round(100.0 * present[i] / eligible[i], 1) if eligible[i] else None,
+                'late': int(late[i]),
+                'current_streak': int(runs[i, -1]),
+                'longest_streak': int(runs[i].max()),
+            }
+            for i, student in enumerate(roster)
+        ]
+
+    def summary(self, roster, start, end):
+        """Class-wide attendance over start..end: totals and one entry per class day"""
+        daily = self._range(start, end)
+        registered = _registered(roster, start)
+        # Keep rows of students on the roster, from the day each registered
+        codes = pd.Index([student['UID'] for student in roster]).get_indexer(
+            daily['uid'].cat.categories)[daily['uid'].cat.codes.to_numpy()]
+        counted = codes >= 0
+        days = np.sort(daily['date'][counted].unique())
+        counted[counted] = daily['date'].to_numpy()[counted] >= registered[codes[counted]]
+        daily = daily[counted]
+        per_day = daily.groupby('date').agg(present=('uid', 'size'), late=('late', 'sum')).reindex(
+            pd.DatetimeIndex(days, name='date'), fill_value=0)
+        enrolled = np.searchsorted(np.sort(registered), per_day.index.to_numpy(), side='right')
+        percentage = np.where(enrolled > 0, 100.0 * per_day['present'].to_numpy() / np.maximum(enrolled, 1), np.nan)
+
+        return {
+            'start': str(start),
+            'end': str(end),
+            'students': len(roster),
+            'class_days': len(per_day),
+            'average_percentage': round(float(np.nanmean(percentage)), 1) if len(per_day) else None,
+            'late_arrivals': int(per_day['late'].sum()),
+            'days': [
+                {
+                    'date': date.strftime('%Y-%m-%d'),
+                    'present': int(present),
+                    'late': int(late),
+                    'percentage': None if np.isnan(pct) else round(float(pct), 1),
+                }
+                for date, present, late, pct in zip(
+                    per_day.index, per_day['present'], per_day['late'], percentage)
+            ],
+        }
+
+    def heatmap(self, start, end, uid=None):
+        """Arrivals (first tap of the day) by weekday and hour over start..end"""
+        first = self._range(start, end, uid)['first']
+        cells = first.dt.weekday.to_numpy() * 24 + first.dt.hour.to_numpy()
+        counts = np.bincount(cells, minlength=7 * 24).reshape(7, 24)
+        return {
+            'start': str(start),
+            'end': str(end),
+            'uid': uid,
+            'weekdays': WEEKDAYS,
+            'hours': list(range(24)),
+            'counts': counts.tolist(),
+        }
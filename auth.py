@@ -0,0 +1,241 @@
+import csv
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from storage import FileLock, append_csv_rows, atomic_write
+
+READER_FIELDS = ['ReaderId', 'KeyHash']
+
+
+class LoginThrottled(Exception):
+    """Too many failed login attempts from a client address, or for a username"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many login attempts, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class VerifierBusy(Exception):
+    """Every password-hashing slot is taken"""
+
+
+class RateLimiter:
+    """Sliding-window limit of failed attempts per key"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def retry_after(self, key, now=None):
+        """Return seconds to wait if key is over the limit, else 0"""
+        now = now or time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            while attempts and attempts[0] <= now - self.window:
+                attempts.popleft()
+            if attempts and len(attempts) >= self.limit:
+                return int(attempts[0] + self.window - now) + 1
+            return 0
+
+    def record(self, key, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            self._attempts.setdefault(key, deque()).append(now)
+            if len(self._attempts) > 10000:
+                self._prune(now)
+
+    def count(self, key, now=None):
+        """Number of attempts recorded for key within the window"""
+        now = now or time.monotonic()
+        with self._lock:
+            attempts = self._attempts.get(key)
+            return sum(1 for t in attempts if t > now - self.window) if attempts else 0
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def _prune(self, now):
+        for key in [k for k, v in self._attempts.items() if not v or v[-1] <= now - self.window]:
+            del self._attempts[key]
+
+
+class PasswordVerifier:
+    """Password hashing off the request threads.
+
+    pbkdf2 runs on a small, bounded pool so a burst of logins can't use up
+    every request thread (or every core) while taps are coming in. Failed
+    attempts are rate limited per client address. A username that keeps
+    failing from many addresses is only paced: it may be tried once per
+    delay (doubling up to max_delay seconds), and attempts in between get
+    LoginThrottled with that short wait, rather than sleeping on a request
+    thread. Nobody can lock an admin out for longer than that by guessing
+    wrong on purpose. A successful check is remembered for cache_ttl
+    seconds so repeated logins skip pbkdf2.
+    """
+
+    def __init__(self, workers=2, max_pending=16, attempts=5, window=60, cache_ttl=300, max_delay=2.0):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._limiter = RateLimiter(attempts, window)
+        self._user_failures = RateLimiter(attempts, window)
+        self._max_delay = max_delay
+        self._user_next = {}  # Username over its failure limit -> earliest next attempt
+        self._cache_ttl = cache_ttl
+        self._cache = {}  # Keyed digest of (username, password, stored hash) -> expiry
+        self._cache_key = os.urandom(32)
+        self._lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise VerifierBusy()
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _digest(self, username, password, stored_hash):
+        message = '\0'.join((username, password, stored_hash)).encode('utf-8')
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def verify(self, username, password, stored_hash, client=None):
+        """Check a password against its stored hash
+
+        Raises LoginThrottled when the client is over the attempt limit or
+        the username is being paced, and VerifierBusy when the pool is
+        saturated.
+        """
+        key = ('client', client) if client else ('user', username)  # No address: fall back to the username
+        retry_after = self._limiter.retry_after(key)
+        if retry_after:
+            raise LoginThrottled(retry_after)
+        excess = self._user_failures.count(username) - self._user_failures.limit + 1
+        if excess > 0:
+            self._pace(username, min(0.25 * 2 ** (excess - 1), self._max_delay))
+
+        if stored_hash is None:
+            self._failed(key, username)
+            return False
+
+        digest = self._digest(username, password, stored_hash)
+        now = time.monotonic()
+        with self._lock:
+            if self._cache.get(digest, 0) > now:
+                valid = True
+            else:
+                self._cache.pop(digest, None)
+                valid = False
+        if not valid:
+            valid = self._run(check_password_hash, stored_hash, password)
+            if valid:
+                with self._lock:
+                    if len(self._cache) >= 1000:
+                        self._cache = {k: v for k, v in self._cache.items() if v > now}
+                    self._cache[digest] = now + self._cache_ttl
+
+        if valid:
+            self._user_failures.reset(username)
+            with self._lock:
+                self._user_next.pop(username, None)
+        else:
+            self._failed(key, username)
+        return valid
+
+    def _pace(self, username, delay):
+        """Let a failing username through at most once per delay seconds"""
+        now = time.monotonic()
+        with self._lock:
+            wait = self._user_next.get(username, 0) - now
+            if wait > 0:
+                raise LoginThrottled(math.ceil(wait))
+            if len(self._user_next) >= 10000:
+                self._user_next = {k: v for k, v in self._user_next.items() if v > now}
+            self._user_next[username] = now + delay
+
+    def _failed(self, key, username):
+        self._limiter.record(key)
+        self._user_failures.record(username)
+
+    def hash(self, password):
+        """generate_password_hash on the pool"""
+        return self._run(generate_password_hash, password)
+
+
+class ReaderKeys:
+    """API keys of the RFID readers, one per reader.
+
+    Only a SHA-256 of each key is stored. Keys are random 192-bit tokens,
+    so a fast hash is enough and a tap never waits on pbkdf2. The file is
+    cached in memory and reloaded when its mtime or size changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._readers = {}  # Key hash -> reader id
+        self._signature = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                readers = {}
+                if signature is not None:
+                    with open(self.path, 'r', newline='') as f:
+                        for row in csv.DictReader(f):
+                            readers[row['KeyHash']] = row['ReaderId']
+                self._readers, self._signature = readers, signature
+            return self._readers
+
+    def reader_for(self, key):
+        """Return the reader id a key belongs to, or None"""
+        if not key:
+            return None
+        return self._load().get(self._hash(key))
+
+    def readers(self):
+        return sorted(set(self._load().values()))
+
+    def add(self, reader_id):
+        """Create a key for reader_id and return it; it is not stored in clear"""
+        key = secrets.token_urlsafe(24)
+        with self._lock:
+            append_csv_rows(self.path, READER_FIELDS, [{'ReaderId': reader_id, 'KeyHash': self._hash(key)}])
+            self._signature = None
+        return key
+
+    def revoke(self, reader_id):
+        """Remove every key of reader_id; returns how many were removed"""
+        with self._lock, FileLock(self.path).exclusive():
+            try:
+                with open(self.path, 'r', newline='') as f:
+                    rows = list(csv.DictReader(f))
+            except FileNotFoundError:
+                return 0
+            kept = [row for row in rows if row['ReaderId'] != reader_id]
+            if len(kept) < len(rows):
+                with atomic_write(self.path, newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=READER_FIELDS)
+                    writer.writeheader()
+                    writer.writerows(kept)
+                self._signature = None
+            return len(rows) - len(kept)
@@ -0,0 +1,522 @@
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+
+# ======================
+# Synthetic Data
+# ======================
+FIRST_NAMES = ['Aarav', 'Diya', 'Ishaan', 'Kavya', 'Rohan', 'Saanvi', 'Vivaan', 'Anaya', 'Arjun', 'Meera']
+LAST_NAMES = ['Sharma', 'Verma', 'Gupta', 'Iyer', 'Khan', 'Reddy', 'Patel', 'Das', 'Nair', 'Singh']
+
+
+def student_uid(number):
+    return f'{number:08x}'  # 4-byte card UID as the reader prints it
+
+
+def synthetic_students(count, registered='2024-01-01'):
+    """Yield count students with unique UIDs"""
+    for number in range(count):
+        yield {
+            'UID': student_uid(number),
+            'Name': f'{FIRST_NAMES[number % 10]} {LAST_NAMES[number // 10 % 10]} {number}',
+            'Email': f'student{number}@example.org',
+            'RegisteredDate': registered,
+        }
+
+
+def arrival_offsets(count, rng, spread=4.0):
+    """Seconds relative to the bell at which count students tap in
+
+    Most arrive in the few minutes before the bell and a tail arrives late,
+    which is what produces the burst readers see at bell time.
+    """
+    offsets = [rng.gauss(-spread * 60, spread * 30) for _ in range(count)]
+    late = int(count * 0.08)
+    offsets[:late] = [rng.expovariate(1 / (spread * 60)) for _ in range(late)]
+    return offsets
+
+
+def synthetic_history(students, days, end, rng, rate=0.9, bell='09:00'):
+    """Yield one day of Present rows at a time for the school days before end"""
+    bell_hour, bell_minute = int(bell[:2]), int(bell[3:5])
+    day = end - timedelta(days=days)
+    while day < end:
+        if day.weekday() < 5:
+            attending = [student for student in students if rng.random() < rate]
+            bell_time = datetime(day.year, day.month, day.day, bell_hour, bell_minute)
+            offsets = arrival_offsets(len(attending), rng)
+            yield [
+                {
+                    'UID': student['UID'],
+                    'Name': student['Name'],
+                    'Timestamp': (bell_time + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S'),
+                    'Status': 'Present',
+                }
+                for student, offset in sorted(zip(attending, offsets), key=lambda pair: pair[1])
+            ]
+        day += timedelta(days=1)
+
+
+def server_config(data_dir, backend):
+    """app.config overrides that point the server at a benchmark data directory"""
+    return {
+        'DATABASE_DIR': data_dir,
+        'STUDENTS_FILE': os.path.join(data_dir, 'students.csv'),
+        'ATTENDANCE_FILE': os.path.join(data_dir, 'attendance.csv'),
+        'ADMINS_FILE': os.path.join(data_dir, 'admins.csv'),
+        'READERS_FILE': os.path.join(data_dir, 'readers.csv'),
+        'ATTENDANCE_DIR': os.path.join(data_dir, 'attendance'),
+        'ATTENDANCE_STATS_FILE': os.path.join(data_dir, 'attendance_stats.json'),
+        'SQLITE_FILE': os.path.join(data_dir, 'attendance.db'),
+        'DEVICE_LOCK_FILE': os.path.join(data_dir, 'device.lock'),
+        'STORAGE_BACKEND': backend,
+        'SERIAL_PORTS': [],
+        'SESSION_COOKIE_SECURE': False,
+    }
+
+
+def generate(data_dir, backend, students, days, seed=1):
+    """Write a synthetic roster and attendance history into data_dir"""
+    import server
+
+    os.makedirs(data_dir, exist_ok=True)
+    server.create_app(server_config(data_dir, backend))
+    if server.students.count():
+        print(f"{data_dir} already has {server.students.count()} students, not generating")
+        return
+
+    rng = random.Random(seed)
+    roster = list(synthetic_students(students))
+    started = time.perf_counter()
+    for i in range(0, len(roster), 100000):
+        server.students.add_many(roster[i:i + 100000])
+    rows = 0
+    for day_rows in synthetic_history(roster, days, date.today(), rng):
+        for i in range(0, len(day_rows), 100000):
+            server.attendance_log.append(day_rows[i:i + 100000])
+        rows += len(day_rows)
+    server.absence_job.run_now()  # Yesterday's absences, so the job's catch-up run has nothing to do mid-benchmark
+    server.attendance_log.save_aggregates()
+    print(f"Generated {students} students and {rows} attendance rows in "
+          f"{time.perf_counter() - started:.1f}s into {data_dir}")
+
+
+# ======================
+# Clients
+# ======================
+class TestClient:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        if isinstance(body, dict):
+            response = self.client.open(path, method=method, json=body, headers=headers or {})
+        else:
+            response = self.client.open(path, method=method, data=body, headers=headers or {})
+        response.get_data()
+        return response.status_code
+
+    def login(self, username, password):
+        return self.client.post('/login', data={'username': username, 'password': password}).status_code
+
+
+class HTTPClient:
+    """Requests to a running server over one keep-alive connection, like a reader"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the idle connection; reconnect once
+            self.connection.close()
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+    def login(self, username, password):
+        return self.request('POST', '/login', body=f'username={username}&password={password}',
+                            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+# ======================
+# Measurements
+# ======================
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    """p50/p90/p99/max latency in milliseconds, throughput and status counts"""
+    values = sorted(latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    counts = {}
+    for status in statuses:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return {
+        'requests': len(values),
+        'statuses': counts,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(values, 0.50)),
+        'p90_ms': ms(percentile(values, 0.90)),
+        'p99_ms': ms(percentile(values, 0.99)),
+        'max_ms': ms(values[-1] if values else None),
+    }
+
+
+def burst_lanes(uids, readers, rng):
+    """[(seconds after the first arrival, uid), ...] for each reader, in arrival order"""
+    offsets = sorted(arrival_offsets(len(uids), rng))
+    schedule = [(offset - offsets[0], uid) for offset, uid in zip(offsets, rng.sample(uids, len(uids)))]
+    return [schedule[i::readers] for i in range(readers)]
+
+
+def tap_burst(make_client, uids, readers, speedup, endpoint, reader_key, rng):
+    """Replay a bell-time burst: every student taps once on one of readers readers
+
+    Taps are spread over the readers and fired at their simulated arrival
+    times, compressed speedup times (0 fires them back to back).
+    """
+    lanes = burst_lanes(uids, readers, rng)
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    headers = {'X-Reader-Key': reader_key} if reader_key else {}
+
+    def run(lane):
+        client = make_client()
+        mine, codes = [], []
+        for at, uid in lane:
+            if speedup:
+                delay = started + at / speedup - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent = time.perf_counter()
+            codes.append(client.request('POST', endpoint, body={'uid': uid}, headers=headers))
+            mine.append(time.perf_counter() - sent)
+        with lock:
+            latencies.extend(mine)
+            statuses.extend(codes)
+
+    threads = [threading.Thread(target=run, args=(lane,)) for lane in lanes if lane]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def start_gateway():
+    """Serve the in-process server's device gateway from a thread; returns (host, port)"""
+    import gateway
+
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(gateway.server_gateway().start('127.0.0.1', 0))
+    threading.Thread(target=loop.run_forever, name='gateway', daemon=True).start()
+    return listener.sockets[0].getsockname()[:2]
+
+
+def gateway_burst(address, uids, readers, speedup, reader_key, rng):
+    """Replay the burst against the device gateway, each reader on one persistent connection
+
+    Every reader connects and says hello before the first tap, then waits
+    for each ack before sending its next tap, as a real reader does.
+    """
+    from gateway import encode_frame, read_frame
+
+    lanes = [lane for lane in burst_lanes(uids, readers, rng) if lane]
+    latencies, statuses = [], []
+
+    async def connect():
+        reader, writer = await asyncio.open_connection(*address)
+        writer.write(encode_frame({'type': 'hello', 'key': reader_key}))
+        welcome = await read_frame(reader)
+        if not welcome or welcome.get('type') != 'welcome':
+            raise RuntimeError(f"Gateway refused the reader: {welcome}")
+        return reader, writer
+
+    async def run(connection, lane, started):
+        reader, writer = connection
+        for number, (at, uid) in enumerate(lane):
+            if speedup:
+                delay = started + at / speedup - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            sent = time.perf_counter()
+            writer.write(encode_frame({'type': 'tap', 'id': number, 'uid': uid}))
+            ack = await read_frame(reader)
+            latencies.append(time.perf_counter() - sent)
+            statuses.append(ack['status'] if ack else 'closed')
+        writer.close()
+
+    async def burst():
+        connections = await asyncio.gather(*(connect() for _ in lanes))
+        started = time.perf_counter()
+        await asyncio.gather(*(run(connection, lane, started) for connection, lane in zip(connections, lanes)))
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(burst())
+    return summarize(latencies, statuses, elapsed)
+
+
+def page_loads(client, path, repeat):
+    """Load path once cold, then repeat times warm; the cold load is reported separately"""
+    sent = time.perf_counter()
+    cold_status = client.request('GET', path)
+    cold = time.perf_counter() - sent
+
+    latencies, statuses = [], []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        sent = time.perf_counter()
+        statuses.append(client.request('GET', path))
+        latencies.append(time.perf_counter() - sent)
+    result = summarize(latencies, statuses, time.perf_counter() - started)
+    result['cold_ms'] = round(cold * 1000, 3)
+    result['cold_status'] = cold_status
+    return result
+
+
+READ_ENDPOINTS = {
+    'dashboard': '/dashboard',
+    'students': '/students',
+    'view_attendance': '/attendance',
+    'view_attendance_filtered': '/attendance?uid={uid}',
+    'attendance_records': '/api/attendance/records?limit=100',
+    'attendance_stats': '/api/attendance_stats?days=30',
+    'analytics_summary': '/api/analytics/summary?days=30',
+    'export_attendance_csv': '/export_attendance?format=csv&date={today}',
+    'export_attendance_xlsx': '/export_attendance?date={today}',
+}
+
+
+# Run in a fresh interpreter per measurement; prints one JSON line. Heavy
+# modules are only counted when the main thread imports them, i.e. on the
+# way to serving: the background warm-up may load NumPy for the presence
+# and index queries it runs, and that is what it is for.
+STARTUP_SCRIPT = """
+import json, sys, threading, time
+heavy, serving = set(sys.argv[2:]), set()
+class Watch:
+    def find_spec(self, name, path=None, target=None):
+        if name in heavy and threading.current_thread() is threading.main_thread():
+            serving.add(name)
+sys.meta_path.insert(0, Watch())
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.create_app(json.loads(sys.argv[1]))
+created = time.perf_counter()
+heavy_modules = sorted(serving)
+server.warmed.wait()
+warmed = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'warm_up_ms': (warmed - created) * 1000,
+    'heavy_modules': heavy_modules,
+    'warm_up_modules': sorted(name for name in heavy if name in sys.modules),
+}))
+"""
+HEAVY_MODULES = ['pandas', 'numpy', 'xlsxwriter', 'serial']  # Should not load before the server can serve
+
+
+def startup_times(data_dir, backend, repeat):
+    """Time `import server`, create_app() and the background warm-up in fresh interpreters"""
+    config = json.dumps(server_config(data_dir, backend))
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, config] + HEAVY_MODULES,
+                                capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(result.stdout.splitlines()[-1]))
+    summary = {'runs': repeat, 'heavy_modules': sorted({name for run in runs for name in run['heavy_modules']}),
+               'warm_up_modules': runs[-1]['warm_up_modules']}
+    for key in ('import_ms', 'create_app_ms', 'warm_up_ms'):
+        values = sorted(run[key] for run in runs)
+        summary[key.replace('_ms', '_p50_ms')] = round(percentile(values, 0.50), 3)
+        summary[key.replace('_ms', '_max_ms')] = round(values[-1], 3)
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def startup(args):
+    """Measure startup against --startup-target-ms; exits non-zero when it is missed"""
+    generate(args.data_dir, args.backend, args.students, args.days, args.seed)
+    results = startup_times(args.data_dir, args.backend, args.repeat)
+    ready_ms = results['import_p50_ms'] + results['create_app_p50_ms']
+    results['target_ms'] = args.startup_target_ms
+    results['passed'] = ready_ms <= args.startup_target_ms and not results['heavy_modules']
+    print(f"startup: {json.dumps(results)}")
+
+    record = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'target': 'startup',
+        'config': {'backend': args.backend, 'students': args.students, 'days': args.days, 'repeat': args.repeat},
+        'results': {'startup': results},
+    }
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"Appended results to {args.output}")
+    if not results['passed']:
+        sys.exit(f"Startup missed its target: {ready_ms:.0f} ms to serve (target {args.startup_target_ms} ms)"
+                 + (f", loaded {', '.join(results['heavy_modules'])}" if results['heavy_modules'] else ''))
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    if args.url:
+        make_client = lambda: HTTPClient(args.url)
+        with open(os.path.join(args.data_dir, 'students.csv'), newline='') as f:
+            uids = [line.split(',', 1)[0] for line in f.read().splitlines()[1:] if line]
+        attendance_writer = None
+    else:
+        generate(args.data_dir, args.backend, args.students, args.days, args.seed)
+        import server
+        make_client = lambda: TestClient(server.app)
+        uids = sorted(server.students.uids())
+        attendance_writer = server.attendance_writer
+
+    if args.url:
+        reader_key = args.reader_key
+    else:
+        import server
+        reader_key = server.reader_keys.add('bench')
+
+    results = {}
+    admin = make_client()
+    username, _, password = args.admin.partition(':')
+    if admin.login(username, password) not in (200, 302):
+        sys.exit(f"Login as {username} failed")
+
+    tappers = uids[:args.taps] if args.taps else uids
+    if args.endpoint == 'gateway':
+        address = args.gateway.rsplit(':', 1) if args.gateway else start_gateway()
+        results['taps'] = gateway_burst(
+            (address[0], int(address[1])), tappers, args.readers, args.speedup, reader_key, rng)
+    else:
+        results['taps'] = tap_burst(make_client, tappers, args.readers, args.speedup, args.endpoint, reader_key, rng)
+    if attendance_writer is not None:
+        started = time.perf_counter()
+        attendance_writer.flush()
+        results['taps']['drain_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    print(f"taps: {json.dumps(results['taps'])}")
+
+    selected = args.only.split(',') if args.only else list(READ_ENDPOINTS)
+    for name in selected:
+        path = READ_ENDPOINTS[name].format(uid=rng.choice(uids), today=date.today())
+        results[name] = page_loads(admin, path, args.repeat)
+        print(f"{name}: {json.dumps(results[name])}")
+
+    record = {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'target': args.url or 'test-client',
+        'config': {
+            'backend': args.backend,
+            'students': len(uids),
+            'days': None if args.url else args.days,  # History of a running server isn't known
+            'readers': args.readers,
+            'taps': len(tappers),
+            'speedup': args.speedup,
+            'endpoint': args.endpoint,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"Appended results to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the attendance server with synthetic rosters, histories and tap bursts.')
+    parser.add_argument('--data-dir', help='Database directory to generate into / benchmark '
+                                           '(default: a new temporary directory)')
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'])
+    parser.add_argument('--students', type=int, default=1000, help='Roster size to generate')
+    parser.add_argument('--days', type=int, default=30, help='Days of attendance history to generate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--generate-only', action='store_true', help='Generate the data and exit')
+    parser.add_argument('--url', help='Benchmark a running server (e.g. http://127.0.0.1:5000) '
+                                      'serving --data-dir instead of the in-process test client')
+    parser.add_argument('--admin', default='admin:admin123', help='username:password to log in with')
+    parser.add_argument('--endpoint', default='/api/attendance', choices=['/api/attendance', '/api/tap', 'gateway'],
+                        help='Where readers send taps; gateway keeps one connection per reader (see gateway.py)')
+    parser.add_argument('--gateway', help='HOST:PORT of the running gateway for --endpoint gateway with --url')
+    parser.add_argument('--reader-key', help='Reader API key for the tap endpoint when using --url')
+    parser.add_argument('--readers', type=int, default=8, help='Simulated readers tapping concurrently')
+    parser.add_argument('--taps', type=int, default=0, help='Students tapping in the burst (default: all)')
+    parser.add_argument('--speedup', type=float, default=0,
+                        help='Replay arrivals this many times faster than real time (0: back to back)')
+    parser.add_argument('--repeat', type=int, default=20, help='Loads per page endpoint')
+    parser.add_argument('--only', help='Comma-separated page endpoints: ' + ', '.join(READ_ENDPOINTS))
+    parser.add_argument('--startup', action='store_true',
+                        help='Measure import and create_app() time in fresh interpreters (--repeat runs) instead')
+    parser.add_argument('--startup-target-ms', type=float, default=500,
+                        help='Most import + create_app() may take (p50) for --startup to pass')
+    parser.add_argument('--output', default='bench_results.jsonl', help='JSON-lines file results are appended to')
+    args = parser.parse_args()
+
+    if args.url and not args.data_dir:
+        parser.error('--url needs the --data-dir the server is using (to pick student UIDs)')
+    if args.url and args.endpoint == 'gateway' and not args.gateway:
+        parser.error('--endpoint gateway with --url needs --gateway HOST:PORT')
+    if args.only and not set(args.only.split(',')) <= set(READ_ENDPOINTS):
+        parser.error(f"--only accepts: {', '.join(READ_ENDPOINTS)}")
+    args.data_dir = args.data_dir or tempfile.mkdtemp(prefix='attendance-bench-')
+
+    if args.generate_only:
+        generate(args.data_dir, args.backend, args.students, args.days, args.seed)
+    elif args.startup:
+        startup(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class DataVersion:
+    """Version stamps of the data behind cached pages.
+
+    bump(name) is called after every committed write to that data
+    ('attendance', 'students'). Each name's version is the mtime of a stamp
+    file in directory, so a write in one worker process invalidates the
+    caches of every other worker for the price of a stat().
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.version')
+
+    def bump(self, name):
+        path = self._path(name)
+        with self._lock:
+            try:
+                previous = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                open(path, 'a').close()
+                previous = 0
+            stamp = max(time.time_ns(), previous + 1)  # Always moves forward, even if the clock doesn't
+            os.utime(path, ns=(stamp, stamp))
+
+    def get(self, *names):
+        """Return the current versions of names (0 for data never written)"""
+        versions = []
+        for name in names:
+            try:
+                versions.append(os.stat(self._path(name)).st_mtime_ns)
+            except FileNotFoundError:
+                versions.append(0)
+        return tuple(versions)
+
+
+class ViewCache:
+    """Computed views, each kept with the data version it was built from.
+
+    Holds at most maxsize keys, dropping the least recently used.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # Key -> (version, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, version, build):
+        """Return the value cached for key at version, calling build() on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = build()  # Outside the lock; concurrent misses may build twice
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
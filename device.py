@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process always owns the device
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceOwner:
+    """Elect one process to own the reader hardware and the background jobs.
+
+    Every worker process calls start(); the first to take a non-blocking
+    fcntl lock on lock_path runs on_acquire() and keeps the lock until it
+    exits. The others retry every retry_interval seconds, so if the owner
+    dies another worker takes over the serial port.
+    """
+
+    def __init__(self, lock_path, on_acquire, retry_interval=5):
+        self.lock_path = lock_path
+        self.on_acquire = on_acquire
+        self.retry_interval = retry_interval
+        self.is_owner = False
+        self._file = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start contending for ownership (once per process)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits the parent's state but not its threads or lock
+            self._pid = os.getpid()
+            self.is_owner = False
+            self._file = None
+            self._thread = threading.Thread(target=self._run, name='device-owner', daemon=True)
+            self._thread.start()
+
+    def _try_acquire(self):
+        if fcntl is None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        f = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        self._file = f  # Held open for the life of the process
+        return True
+
+    def _run(self):
+        while not self._try_acquire():
+            time.sleep(self.retry_interval)
+        self.is_owner = True
+        logger.info("Process %d owns the reader device", os.getpid())
+        try:
+            self.on_acquire()
+        except Exception:
+            logger.exception("Starting device owner services failed")
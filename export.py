@@ -0,0 +1,111 @@
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+import zlib
+
+EXPORT_FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'ndjson.gz': ('application/gzip', 'ndjson.gz'),
+}
+
+STREAM_BLOCK = 64 * 1024  # Bytes per chunk when streaming a finished file
+XLSX_MAX_ROWS = 1048576   # Rows per worksheet, including the header
+
+
+def _gzip(blocks):
+    """Compress a stream of byte blocks into a gzip stream"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip header and trailer
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_csv(columns, chunks):
+    """Yield CSV bytes one chunk of rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_ndjson(columns, chunks):
+    """Yield one JSON object per line, one chunk of rows at a time"""
+    for rows in chunks:
+        yield ''.join(
+            json.dumps({column: row[column] for column in columns}) + '\n' for row in rows
+        ).encode('utf-8')
+
+
+def stream_xlsx(sheet_name, columns, chunks):
+    """Write rows through xlsxwriter's constant-memory mode, then stream the file
+
+    Only one row is held in memory at a time while writing. Column widths
+    are sized from the header and the first chunk, since constant-memory
+    mode needs them before any row is written. Histories longer than one
+    worksheet allows continue on "<sheet_name> 2", "<sheet_name> 3", ...
+    """
+    import xlsxwriter  # Loaded with the first spreadsheet export
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+
+        chunks = iter(chunks)
+        first = next(chunks, [])
+        widths = [
+            max([len(str(column))] + [len(str(row[column])) for row in first]) + 1
+            for column in columns
+        ]
+
+        def add_worksheet(number):
+            worksheet = workbook.add_worksheet(sheet_name if number == 1 else f'{sheet_name} {number}')
+            for idx, width in enumerate(widths):
+                worksheet.set_column(idx, idx, width)
+            worksheet.write_row(0, 0, columns)
+            return worksheet
+
+        sheets = 1
+        worksheet = add_worksheet(sheets)
+        row_number = 1
+        for rows in itertools.chain([first], chunks):
+            for row in rows:
+                if row_number == XLSX_MAX_ROWS:
+                    sheets += 1
+                    worksheet = add_worksheet(sheets)
+                    row_number = 1
+                worksheet.write_row(row_number, 0, [row[column] for column in columns])
+                row_number += 1
+        workbook.close()
+
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(STREAM_BLOCK)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(path)
+
+
+def stream_export(export_format, sheet_name, columns, chunks):
+    """Return a byte generator for chunks of rows in the requested format"""
+    if export_format == 'xlsx':
+        return stream_xlsx(sheet_name, columns, chunks)
+    base, _, compression = export_format.partition('.')
+    blocks = stream_csv(columns, chunks) if base == 'csv' else stream_ndjson(columns, chunks)
+    return _gzip(blocks) if compression == 'gz' else blocks
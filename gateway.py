@@ -0,0 +1,319 @@
+"""Asyncio gateway for RFID readers that keep one connection open.
+
+    python gateway.py --port 5001
+
+Readers connect over TCP and exchange frames: a 4-byte big-endian length,
+then that many bytes of a UTF-8 JSON object.
+
+    reader -> {"type": "hello", "key": "<reader API key>"}
+           <- {"type": "welcome", "reader": "<reader id>"}
+    reader -> {"type": "tap", "id": 17, "uid": "A1B2C3D4"}
+           <- {"type": "ack", "id": 17, "status": "new", "name": "...", "first_seen": "09:01:44"}
+    reader -> {"type": "ping"}
+           <- {"type": "pong"}
+
+A tap may carry "timestamp" (epoch seconds) for taps buffered offline;
+otherwise it is stamped when the gateway receives it. Ack statuses are
+those of /api/tap ("new", "duplicate", "unregistered"), plus "invalid"
+for a malformed tap and "busy" for one that could not be recorded, e.g.
+because the attendance writer's queue is full (retry later). A bad hello
+or a malformed frame gets {"type": "error"} and the connection is closed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import queue
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>I')
+MAX_FRAME = 4096  # Bytes; readers only send small objects
+
+
+class ProtocolError(Exception):
+    """A peer sent something that isn't a valid frame"""
+
+
+async def read_frame(reader):
+    """Read one frame and return its object, or None if the peer closed the connection"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError('truncated frame')
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError(f'frame of {length} bytes is too long')
+    try:
+        message = json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        raise ProtocolError('truncated frame')
+    except ValueError:
+        raise ProtocolError('frame is not JSON')
+    if not isinstance(message, dict):
+        raise ProtocolError('frame is not a JSON object')
+    return message
+
+
+def encode_frame(message):
+    payload = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(payload)) + payload
+
+
+def _tap_timestamp(value):
+    if value is None:
+        return datetime.now()
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('timestamp must be epoch seconds')
+    return datetime.fromtimestamp(value)
+
+
+class RosterCache:
+    """Registered UIDs, reloaded whenever the roster's data version changes
+
+    load() returns the UIDs and version() a cheap token that changes with
+    every roster write (a DataVersion stamp); both run on a worker thread.
+    """
+
+    def __init__(self, load, version, interval=1.0):
+        self.interval = interval
+        self._load = load
+        self._version = version
+        self._loaded_version = None
+        self.uids = frozenset()
+
+    def __contains__(self, uid):
+        return uid in self.uids
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, self._version)
+        if version != self._loaded_version:
+            self.uids = frozenset(await loop.run_in_executor(None, self._load))
+            self._loaded_version = version
+
+    async def follow(self):
+        """Refresh every interval seconds, for as long as the gateway runs"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Reloading the roster failed")
+
+
+class TapGateway:
+    """Serve the frame protocol above to any number of readers on one event loop.
+
+    Each connection is a coroutine rather than a thread, so thousands of
+    mostly idle readers cost a socket each. A tap whose UID isn't in the
+    cached roster is answered straight away. Registered taps are collected
+    for up to batch_ms, or batch_rows taps, and recorded together by
+    record_taps([(uid, timestamp), ...]) on a worker thread, which returns
+    (name, status, first_seen) per tap; each reader gets its ack as soon as
+    its batch is recorded. One batch is recorded at a time, so taps that
+    arrive meanwhile form the next one.
+
+    on_ack(status, seconds), if given, is called with the time from
+    receiving each tap to acknowledging it.
+    """
+
+    def __init__(self, record_taps, reader_for, roster, batch_rows=500, batch_ms=2,
+                 hello_timeout=10, idle_timeout=300, on_ack=None):
+        self.record_taps = record_taps
+        self.reader_for = reader_for
+        self.roster = roster
+        self.batch_rows = batch_rows
+        self.batch_ms = batch_ms
+        self.hello_timeout = hello_timeout
+        self.idle_timeout = idle_timeout  # Readers ping more often than this
+        self.on_ack = on_ack
+        self._pending = []  # (uid, timestamp, future) waiting for the next batch
+        self._flush_handle = None
+        self._recording = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gateway-record')
+        self._connections = 0
+        self._batches = 0
+        self._tasks = set()  # Running background tasks, kept referenced until they finish
+
+    def stats(self):
+        return {'connections': self._connections, 'pending': len(self._pending), 'batches': self._batches}
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Load the roster and start listening; returns the asyncio server"""
+        await self.roster.refresh()
+        self._spawn(self.roster.follow())
+        return await asyncio.start_server(self._handle, host, port, backlog=4096)
+
+    async def serve(self, host, port):
+        server = await self.start(host, port)
+        logger.info("Gateway listening on %s", ', '.join(str(s.getsockname()) for s in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+    # ---- Connections ----
+
+    async def _handle(self, reader, writer):
+        self._connections += 1
+        try:
+            hello = await asyncio.wait_for(read_frame(reader), self.hello_timeout)
+            if hello is None:
+                return
+            reader_id = None
+            if hello.get('type') == 'hello':
+                reader_id = await asyncio.get_running_loop().run_in_executor(
+                    None, self.reader_for, hello.get('key'))
+            if reader_id is None:
+                writer.write(encode_frame({'type': 'error', 'error': 'invalid reader key'}))
+                return
+            writer.write(encode_frame({'type': 'welcome', 'reader': reader_id}))
+
+            while True:
+                message = await asyncio.wait_for(read_frame(reader), self.idle_timeout)
+                if message is None:
+                    return
+                kind = message.get('type')
+                if kind == 'tap':
+                    self._tap(message, writer)
+                elif kind == 'ping':
+                    writer.write(encode_frame({'type': 'pong'}))
+                else:
+                    writer.write(encode_frame({'type': 'error', 'error': f'unknown message type: {kind}'}))
+                await writer.drain()
+        except ProtocolError as e:
+            writer.write(encode_frame({'type': 'error', 'error': str(e)}))
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self._connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def _tap(self, message, writer):
+        received = time.perf_counter()
+        tap_id = message.get('id')
+
+        def ack(name, status, first_seen):
+            if not writer.is_closing():
+                writer.write(encode_frame({
+                    'type': 'ack', 'id': tap_id, 'status': status, 'name': name, 'first_seen': first_seen}))
+            if self.on_ack:
+                self.on_ack(status, time.perf_counter() - received)
+
+        uid = message.get('uid')
+        if not isinstance(uid, str) or not uid or len(uid) > 64 or any(c.isspace() for c in uid):
+            return ack('', 'invalid', '')
+        try:
+            timestamp = _tap_timestamp(message.get('timestamp'))
+        except (ValueError, OverflowError, OSError):
+            return ack('', 'invalid', '')
+        if uid not in self.roster:
+            return ack('', 'unregistered', '')
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda done: ack(*done.result()))
+        self._pending.append((uid, timestamp, future))
+        if len(self._pending) >= self.batch_rows:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_ms / 1000, self._flush)
+
+    # ---- Batches ----
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._recording or not self._pending:
+            return  # The batch being recorded flushes the rest when it is done
+        batch, self._pending = self._pending[:self.batch_rows], self._pending[self.batch_rows:]
+        self._recording = True
+        self._spawn(self._record(batch))
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _record(self, batch):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self.record_taps, [(uid, timestamp) for uid, timestamp, _ in batch])
+        except queue.Full:
+            results = [('', 'busy', '')] * len(batch)
+        except Exception:
+            logger.exception("Recording a batch of %d taps failed", len(batch))
+            results = [('', 'busy', '')] * len(batch)
+        self._batches += 1
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+        self._recording = False
+        if self._pending:
+            self._flush()
+
+
+def server_gateway(**options):
+    """A TapGateway over the attendance server's services (create_app() must have run)"""
+    import server
+
+    def record_taps(taps):
+        acks = []
+        for (uid, timestamp), (student, status) in zip(taps, server.record_taps(taps)):
+            if student is None:
+                acks.append(('', status, ''))
+                continue
+            first_seen = server.presence.first_seen(uid, (timestamp or datetime.now()).strftime('%Y-%m-%d'))
+            acks.append((student['Name'], status, first_seen.strftime('%H:%M:%S') if first_seen else ''))
+        return acks
+
+    metrics = server.metrics
+    metrics.describe('attendance_gateway_connections', 'gauge', 'Readers connected to the device gateway')
+    metrics.describe('attendance_gateway_acks_total', 'counter', 'Taps acknowledged by the device gateway, by status')
+    metrics.describe('attendance_gateway_ack_seconds', 'histogram', 'Time from receiving a tap to acknowledging it')
+
+    def on_ack(status, seconds):
+        metrics.inc('attendance_gateway_acks_total', status=status)
+        metrics.observe('attendance_gateway_ack_seconds', seconds)
+
+    gateway = TapGateway(
+        record_taps,
+        server.reader_keys.reader_for,
+        RosterCache(server.students.uids, lambda: server.data_version.get('students')),
+        on_ack=on_ack,
+        **options
+    )
+    metrics.add_collector(lambda: [('attendance_gateway_connections', {}, gateway.stats()['connections'])])
+    return gateway
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asyncio gateway for RFID readers on persistent connections.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--batch-rows', type=int, default=500, help='Most taps recorded in one batch')
+    parser.add_argument('--batch-ms', type=float, default=2, help='Longest a tap waits for its batch to fill')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    import server
+    server.create_app({'WARM_UP': 'eager'})
+    server.presence.shared = True  # The web workers record taps too
+    server.metrics.share(server.app.config['METRICS_DIR'], interval=server.app.config['METRICS_SHARE_INTERVAL'])
+    gateway = server_gateway(batch_rows=args.batch_rows, batch_ms=args.batch_ms)
+    try:
+        asyncio.run(gateway.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import gc
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 8          # Live-view streams hold a thread each, up to LIVE_MAX_SUBSCRIBERS
+timeout = 60
+keepalive = 5        # Seconds an idle reader connection is kept open for its next tap
+preload_app = True   # Load the app once in the master, before forking
+
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the collector's reach, so the
+    # workers' garbage collections don't touch (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import server as attendance_server
+    attendance_server.after_fork()
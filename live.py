@@ -0,0 +1,85 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class LiveFeed:
+    """Ring buffer of recent attendance rows with push-based subscribers.
+
+    publish() is called after rows are committed. Each subscriber gets a
+    bounded queue; a subscriber that falls too far behind is dropped rather
+    than slowing down the writer.
+    """
+
+    def __init__(self, size=100, subscriber_queue_size=256):
+        self._recent = deque(maxlen=size)
+        self._subscribers = set()
+        self._subscriber_queue_size = subscriber_queue_size
+        self._lock = threading.Lock()
+
+    def seed(self, rows):
+        """Replace the buffer with the newest rows already in the log (oldest first)"""
+        with self._lock:
+            self._recent.clear()
+            self._recent.extend(rows)
+
+    def publish(self, rows):
+        with self._lock:
+            self._recent.extend(rows)
+            for subscriber in list(self._subscribers):
+                if subscriber.qsize() + len(rows) > self._subscriber_queue_size:
+                    self._subscribers.discard(subscriber)
+                    subscriber.put(None)  # Tell the stream to close
+                    continue
+                for row in rows:
+                    subscriber.put(row)
+
+    def follow(self, repository, interval=0.5):
+        """Publish rows appended to repository by any process, polling every interval seconds
+
+        Used instead of a writer listener when several worker processes
+        write to the same log, so every worker's subscribers see every tap.
+        The buffer is re-seeded from the log first, since a worker forked
+        some time after the master seeded it would otherwise start stale.
+        """
+        threading.Thread(
+            target=self._follow, args=(repository, interval), name='live-follow', daemon=True).start()
+
+    def _follow(self, repository, interval):
+        self.seed(repository.tail(self._recent.maxlen))
+        _, position = repository.changes_since()
+        while True:
+            time.sleep(interval)
+            try:
+                rows, position = repository.changes_since(position)
+            except Exception:
+                logger.exception("Following the attendance log failed")
+                continue
+            if rows:
+                self.publish(rows)
+
+    def recent(self, n):
+        """Return up to the last n rows, oldest first"""
+        with self._lock:
+            return list(self._recent)[-n:]
+
+    def subscribe(self, limit=None):
+        """Return a new subscriber queue, or None if limit subscribers are already open"""
+        subscriber = queue.Queue()  # Bounded by the size check in publish()
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
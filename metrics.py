@@ -0,0 +1,264 @@
+import cProfile
+import glob
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Counters, gauges and latency histograms rendered in Prometheus text format.
+
+    Metrics are declared once with describe() and then updated by name
+    with keyword labels. Collectors registered with add_collector() are
+    called at snapshot time for values kept elsewhere (e.g. queue depth).
+
+    Each process keeps its own values. With share(directory), a process
+    writes a snapshot to directory every interval seconds, and render()
+    adds up the snapshots of every live process, so any worker can answer
+    a scrape for the whole server.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._types = {}    # name -> (type, help)
+        self._values = {}   # (name, labels) -> number, or [bucket counts..., sum, count] for histograms
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._directory = None
+        self._thread = None
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = (metric_type, help_text)
+
+    def add_collector(self, collector):
+        """collector() returns [(name, labels dict, value), ...] for described metrics"""
+        self._collectors.append(collector)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # ---- Snapshots ----
+
+    def snapshot(self):
+        """Return this process's values as [[name, labels, value], ...]"""
+        with self._lock:
+            values = [[name, list(labels), value if not isinstance(value, list) else list(value)]
+                      for (name, labels), value in self._values.items()]
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    values.append([name, sorted(labels.items()), value])
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return values
+
+    def share(self, directory, interval=5.0):
+        """Publish snapshots for other processes (call once per worker, after forking)"""
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._publish_loop, args=(interval,), name='metrics', daemon=True)
+        self._thread.start()
+
+    def _snapshot_path(self, pid):
+        return os.path.join(self._directory, f'{pid}.json')
+
+    def _publish(self):
+        path = self._snapshot_path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def _publish_loop(self, interval):
+        while True:
+            try:
+                self._publish()
+            except OSError:
+                logger.exception("Writing the metrics snapshot failed")
+            time.sleep(interval)
+
+    def _peer_snapshots(self):
+        for path in glob.glob(os.path.join(self._directory, '*.json')):
+            pid = int(os.path.basename(path).split('.')[0])
+            if pid == os.getpid():
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os.remove(path)  # Worker gone; its counters go with it
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path) as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    # ---- Rendering ----
+
+    def render(self):
+        """Prometheus text exposition of this process, plus live peers when shared"""
+        snapshots = [self.snapshot()]
+        if self._directory:
+            snapshots.extend(self._peer_snapshots())
+
+        totals = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if isinstance(value, list):
+                    current = totals.setdefault(key, [0] * len(value))
+                    for i, part in enumerate(value):
+                        current[i] += part
+                else:
+                    totals[key] = totals.get(key, 0) + value
+
+        lines = []
+        for name in sorted({name for name, _ in totals}):
+            metric_type, help_text = self._types.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for (metric, labels), value in sorted(totals.items()):
+                if metric != name:
+                    continue
+                if metric_type == 'histogram':
+                    for bound, count in zip(self.buckets, value):
+                        lines.append(f'{name}_bucket{_labels(labels, [("le", _number(bound))])} {count}')
+                    lines.append(f'{name}_bucket{_labels(labels, [("le", "+Inf")])} {value[-1]}')
+                    lines.append(f'{name}_sum{_labels(labels)} {_number(value[-2])}')
+                    lines.append(f'{name}_count{_labels(labels)} {value[-1]}')
+                else:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TimedRepository:
+    """Wrap a repository so the named methods are timed into a metrics histogram
+
+    operations maps method names to the operation label they are recorded
+    under; every other attribute passes straight through.
+    """
+
+    def __init__(self, repository, metrics, histogram, operations):
+        self._repository = repository
+        self._metrics = metrics
+        self._histogram = histogram
+        self._operations = operations
+
+    def __getattr__(self, name):
+        attribute = getattr(self._repository, name)
+        operation = self._operations.get(name)
+        if operation is None or not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            with self._metrics.timer(self._histogram, operation=operation):
+                return attribute(*args, **kwargs)
+        return timed
+
+    def __contains__(self, item):
+        return item in self._repository
+
+
+class RequestProfiler:
+    """Opt-in cProfile of requests, keeping the keep slowest on disk.
+
+    One request is profiled at a time (others run unprofiled), since only
+    one profiler can be active per process on recent Pythons. A request
+    slower than min_ms that ranks among the keep slowest so far is dumped
+    to directory as '<ms>ms-<endpoint>-<time>.prof' (open it with pstats
+    or snakeviz); files that drop out of the ranking are deleted.
+    """
+
+    def __init__(self, directory, keep=20, min_ms=100):
+        self.directory = directory
+        self.keep = keep
+        self.min_ms = min_ms
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._slowest = []  # Min-heap of (ms, path)
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.prof')):
+            match = re.match(r'(\d+)ms-', os.path.basename(path))
+            if match:
+                heapq.heappush(self._slowest, (int(match.group(1)), path))
+
+    def start(self):
+        """Return a running profile for this request, or None if another request holds it"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiling tool is active
+            self._busy.release()
+            return None
+        return profile
+
+    def finish(self, profile, seconds, label):
+        profile.disable()
+        self._busy.release()
+        ms = int(seconds * 1000)
+        if ms < self.min_ms:
+            return
+        with self._lock:
+            if len(self._slowest) >= self.keep and ms <= self._slowest[0][0]:
+                return
+            name = re.sub(r'[^A-Za-z0-9_.]+', '_', label)
+            path = os.path.join(self.directory, f'{ms}ms-{name}-{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}.prof')
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (ms, path))
+            while len(self._slowest) > self.keep:
+                _, dropped = heapq.heappop(self._slowest)
+                try:
+                    os.remove(dropped)
+                except FileNotFoundError:
+                    pass
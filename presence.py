@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+class PresenceIndex:
+    """In-memory record of who has tapped in on each day.
+
+    claim() decides whether a tap is new or a repeat, so repeat taps cost a
+    dictionary lookup instead of a disk write. With window=None a student
+    is recorded once per day; with window=N a repeat tap is recorded again
+    once N seconds have passed since the last recorded one.
+
+    A day is loaded from the log the first time it is touched. With
+    shared=True (several worker processes writing the same log) a new tap
+    is claimed straight away and then re-checked against the log outside
+    the lock, since another worker may have recorded it. That dedupe is
+    best-effort: two workers claiming the same student at the same moment
+    both miss each other's not-yet-written row, and both taps are kept.
+    """
+
+    def __init__(self, repository, window=None, max_days=3, shared=False):
+        self.repository = repository
+        self.window = window
+        self.max_days = max_days
+        self.shared = shared
+        self._days = OrderedDict()  # 'YYYY-MM-DD' -> {uid: [first, last] recorded datetime}
+        self._lock = threading.Lock()
+
+    def _load(self, date):
+        day = {}
+        for row in self.repository.query(date=date, status='Present'):
+            _remember(day, row['UID'], datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S'))
+        return day
+
+    def _day(self, date):
+        day = self._days.get(date)
+        if day is None:
+            day = self._days[date] = self._load(date)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        else:
+            self._days.move_to_end(date)
+        return day
+
+    def warm(self, date=None):
+        """Load a day (today by default) ahead of the first tap"""
+        with self._lock:
+            self._day(date or datetime.now().strftime('%Y-%m-%d'))
+
+    def _is_repeat(self, last, timestamp):
+        if last is None:
+            return False
+        return self.window is None or abs((timestamp - last).total_seconds()) < self.window
+
+    def _last(self, day, uid):
+        entry = day.get(uid)
+        return entry[1] if entry else None
+
+    def claim(self, uid, timestamp):
+        """Return True and remember the tap if it is new, False if it is a repeat"""
+        date = timestamp.strftime('%Y-%m-%d')
+        with self._lock:
+            day = self._day(date)
+            if self._is_repeat(self._last(day, uid), timestamp):
+                return False
+            _remember(day, uid, timestamp)
+        if not self.shared:
+            return True
+
+        # Another worker may have recorded this student since the day was loaded;
+        # read the log without holding the lock, so other taps aren't kept waiting
+        recorded = [datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S')
+                    for row in self.repository.query(date=date, status='Present', uid=uid)]
+        if not any(self._is_repeat(seen, timestamp) for seen in recorded):
+            return True
+        self.release(uid, timestamp)
+        with self._lock:
+            day = self._days.get(date)
+            if day is not None:
+                for seen in recorded:
+                    _remember(day, uid, seen)
+        return False
+
+    def first_seen(self, uid, date):
+        """Return the first recorded tap of uid on a 'YYYY-MM-DD' date, or None"""
+        with self._lock:
+            entry = self._day(date).get(uid)
+            return entry[0] if entry else None
+
+    def release(self, uid, timestamp):
+        """Forget a claimed tap that could not be written"""
+        with self._lock:
+            day = self._days.get(timestamp.strftime('%Y-%m-%d'))
+            entry = day.get(uid) if day is not None else None
+            if entry is None or entry[1] != timestamp:
+                return
+            if entry[0] == timestamp:
+                del day[uid]
+            else:
+                entry[1] = entry[0]  # The tap before it isn't kept; fall back to the first
+
+
+def _remember(day, uid, timestamp):
+    entry = day.get(uid)
+    if entry is None:
+        day[uid] = [timestamp, timestamp]
+    else:
+        entry[0] = min(entry[0], timestamp)
+        entry[1] = max(entry[1], timestamp)
@@ -0,0 +1,63 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class DailyJob:
+    """Run callback(day) once a day, at a fixed local time, on a background thread.
+
+    day is the date that just ended when the job runs shortly after
+    midnight. On start the job also runs for each of the last
+    catch_up_days days, oldest first, so a server that was down at the
+    scheduled times catches up on up to that many days; the callback must
+    therefore be idempotent.
+    """
+
+    def __init__(self, name, callback, at='00:05', catch_up_days=1):
+        self.name = name
+        self.callback = callback
+        self.catch_up_days = catch_up_days
+        hour, minute = map(int, at.split(':'))
+        self.hour, self.minute = hour, minute
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_run = None      # Day the callback last completed for
+        self.last_error = None
+
+    def next_run(self, now=None):
+        now = now or datetime.now()
+        run = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        return run if run > now else run + timedelta(days=1)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_now(self, day=None):
+        """Run the callback for day (yesterday by default) on the caller's thread"""
+        day = day or datetime.now().date() - timedelta(days=1)
+        try:
+            result = self.callback(day)
+            self.last_run, self.last_error = day, None
+            return result
+        except Exception as e:
+            self.last_error = str(e)
+            logger.exception("%s failed for %s", self.name, day)
+
+    def _run(self):
+        today = datetime.now().date()
+        for days_ago in range(self.catch_up_days, 0, -1):
+            self.run_now(today - timedelta(days=days_ago))
+        while not self._stop.wait((self.next_run() - datetime.now()).total_seconds()):
+            self.run_now()
@@ -0,0 +1,181 @@
+import logging
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+
+import serial
+
+logger = logging.getLogger(__name__)
+
+UID_LINE = re.compile(r'^UID:\s*([0-9A-Fa-f]+)\s*$')  # As printed by the reader firmware
+
+
+class Debouncer:
+    """Drop repeat taps of the same UID within window seconds"""
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._last_seen = {}
+
+    def accept(self, uid, now):
+        last = self._last_seen.get(uid)
+        if last is not None and now - last < self.window:
+            return False
+        self._last_seen[uid] = now
+        if len(self._last_seen) > 10000:
+            self._last_seen = {k: v for k, v in self._last_seen.items() if now - v < self.window}
+        return True
+
+
+class SerialIngestor:
+    """Read taps from readers connected over USB serial.
+
+    One thread per port reads the 'UID:<hex>' lines the firmware prints and
+    reopens the port whenever it disappears. A single batching thread
+    debounces repeat taps across all ports and hands them to
+    handle_batch([(uid, timestamp), ...]) in groups of up to batch_size,
+    or whatever arrived within batch_ms. If handle_batch raises (e.g. the
+    write queue is full) the batch is retried, so taps are not lost.
+
+    Ports are opened with serial.serial_for_url, so a pty path or a
+    'loop://' URL works in place of a device.
+    """
+
+    def __init__(self, ports, handle_batch, baudrate=115200, debounce=5.0,
+                 batch_size=50, batch_ms=200, reconnect_delay=2.0, serial_factory=None):
+        self.ports = list(ports)
+        self.handle_batch = handle_batch
+        self.baudrate = baudrate
+        self.batch_size = batch_size
+        self.batch_delay = batch_ms / 1000.0
+        self.reconnect_delay = reconnect_delay
+        self._serial_factory = serial_factory or serial.serial_for_url
+        self._debouncer = Debouncer(debounce)
+        self._taps = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {port: {'connected': False, 'taps': 0, 'duplicates': 0,
+                              'ignored_lines': 0, 'reconnects': 0} for port in self.ports}
+        self._handled = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for port in self.ports:
+            self._threads.append(threading.Thread(
+                target=self._read_port, args=(port,), name=f'serial-{port}', daemon=True))
+        self._threads.append(threading.Thread(target=self._run_batches, name='serial-batches', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ports': {port: dict(stats) for port, stats in self._stats.items()},
+                'pending': self._taps.qsize(),
+                'handled': self._handled,
+            }
+
+    def _count(self, port, key, connected=None):
+        with self._lock:
+            self._stats[port][key] += 1
+            if connected is not None:
+                self._stats[port]['connected'] = connected
+
+    # ---- Reading ----
+
+    def _open(self, port):
+        """Open the port, retrying with backoff until it appears or we are stopped"""
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            try:
+                return self._serial_factory(port, baudrate=self.baudrate, timeout=1)
+            except (serial.SerialException, OSError) as e:
+                logger.warning("Can't open serial port %s (%s), retrying in %.0fs", port, e, delay)
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30)
+        return None
+
+    def _read_port(self, port):
+        while not self._stop.is_set():
+            connection = self._open(port)
+            if connection is None:
+                return
+            with self._lock:
+                self._stats[port]['connected'] = True
+            try:
+                self._read_lines(port, connection)
+            except (serial.SerialException, OSError) as e:
+                logger.warning("Serial port %s failed (%s), reconnecting", port, e)
+                self._count(port, 'reconnects', connected=False)
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                connection.close()
+
+    def _read_lines(self, port, connection):
+        pending = b''
+        while not self._stop.is_set():
+            data = connection.readline()  # Returns early (maybe mid-line) on the 1s timeout
+            if not data:
+                continue
+            pending += data
+            if not pending.endswith(b'\n'):
+                continue
+            line, pending = pending.decode('utf-8', errors='replace').strip(), b''
+            match = UID_LINE.match(line)
+            if match is None:
+                if line:
+                    self._count(port, 'ignored_lines')  # Boot messages and other debug output
+                continue
+            self._taps.put((port, match.group(1), datetime.now(), time.monotonic()))
+
+    # ---- Batching ----
+
+    def _next_batch(self):
+        """Collect up to batch_size debounced taps, waiting at most batch_ms after the first"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = 0.5  # Idle: wake up now and then to notice stop()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                port, uid, timestamp, seen_at = self._taps.get(timeout=timeout)
+            except queue.Empty:
+                if deadline is None and not self._stop.is_set():
+                    continue
+                break
+            if not self._debouncer.accept(uid, seen_at):
+                self._count(port, 'duplicates')
+                continue
+            self._count(port, 'taps')
+            batch.append((uid, timestamp))
+            if deadline is None:
+                deadline = time.monotonic() + self.batch_delay
+        return batch
+
+    def _run_batches(self):
+        while not (self._stop.is_set() and self._taps.empty()):
+            batch = self._next_batch()
+            while batch:
+                try:
+                    self.handle_batch(batch)
+                except Exception:
+                    logger.exception("Recording %d serial taps failed, retrying", len(batch))
+                    time.sleep(1)
+                    continue
+                with self._lock:
+                    self._handled += len(batch)
+                batch = None
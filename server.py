@@ -1,12 +1,27 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, send_file
+from flask import Flask, Response, g, request, session, jsonify, render_template, redirect, url_for, flash
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
-import csv
 import os
-import pandas as pd
-from io import BytesIO
-import serial  # Import the serial library
+from functools import wraps
+import atexit
+import json
+import queue
+import threading
+import time
+import click
+from storage import ATTENDANCE_FIELDS, STUDENT_FIELDS, CSVStorage, SQLiteStorage, migrate, open_storage
+from writer import AttendanceWriter
+from live import LiveFeed
+from scheduler import DailyJob
+from auth import LoginThrottled, PasswordVerifier, ReaderKeys, VerifierBusy
+from device import DeviceOwner
+from presence import PresenceIndex
+from cache import DataVersion, ViewCache
+from markupsafe import Markup
+from export import EXPORT_FORMATS, stream_export
+from student_import import IMPORT_FORMATS, import_students
+from metrics import Metrics, RequestProfiler, TimedRepository
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a strong secret key!
@@ -18,8 +33,54 @@ app.config['DATABASE_DIR'] = 'Database'
 app.config['STUDENTS_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'students.csv')
 app.config['ATTENDANCE_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'attendance.csv')
 app.config['ADMINS_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'admins.csv')
+app.config['READERS_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'readers.csv')  # API key hashes of the RFID readers
+app.config['ATTENDANCE_DIR'] = os.path.join(app.config['DATABASE_DIR'], 'attendance')
+app.config['ATTENDANCE_PARTITION'] = 'day'  # 'day', 'month' or None for the single ATTENDANCE_FILE
+app.config['ATTENDANCE_COMPACT_AFTER_DAYS'] = 7  # Older partitions are compacted ...
+app.config['ATTENDANCE_COMPACT_FORMAT'] = None  # ... to 'parquet' (pyarrow) or 'csv.gz'; None: Parquet when pyarrow is installed
+app.config['ATTENDANCE_STATS_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'attendance_stats.json')
+app.config['SQLITE_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'attendance.db')
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'csv')  # 'csv' or 'sqlite'
+app.config['ATTENDANCE_BATCH_LIMIT'] = 500  # Max events per /api/attendance/batch request
+app.config['ATTENDANCE_DURABILITY'] = 'group'  # 'sync', 'group' or 'async' (see writer.py)
+app.config['ATTENDANCE_FLUSH_ROWS'] = 100  # Group commit after this many rows...
+app.config['ATTENDANCE_FLUSH_MS'] = 50  # ...or after this many milliseconds
+app.config['ATTENDANCE_QUEUE_SIZE'] = 10000  # Pending writes before taps are rejected with 503
+app.config['ATTENDANCE_DEBOUNCE_SECONDS'] = None  # None: one Present row per student per day; N: again after N seconds
+app.config['ABSENCE_JOB_TIME'] = '00:05'  # Local time the previous day's absences are marked
+app.config['ABSENCE_CATCH_UP_DAYS'] = 7  # Days closed again at startup, covering downtime
+app.config['LIVE_FEED_SIZE'] = 100  # Recent rows kept in memory for the live view
+app.config['LIVE_FOLLOW_INTERVAL'] = 0.5  # Seconds between log polls for the live view under several workers
+app.config['LIVE_STREAM_KEEPALIVE'] = 15  # Seconds between SSE keep-alive comments
+app.config['LIVE_MAX_SUBSCRIBERS'] = 4  # Open SSE streams per process (each holds a request thread); others poll
+app.config['EXPORT_CHUNK_ROWS'] = 5000  # Rows read and written per export chunk
+app.config['ATTENDANCE_PAGE_SIZE'] = 50  # Rows per page on the attendance view
+app.config['ATTENDANCE_MAX_PAGE_SIZE'] = 500
+app.config['ANALYTICS_LATE_AFTER'] = '09:15'  # First taps after this time of day count as late
+app.config['ANALYTICS_REFRESH_SECONDS'] = 5  # Analytics pick up new taps at most this often
+app.config['ANALYTICS_MAX_DAYS'] = 366  # Longest range an analytics request may cover
+app.config['LOGIN_WORKERS'] = 2  # Threads hashing passwords; logins beyond these queue
+app.config['LOGIN_QUEUE_SIZE'] = 16  # Logins waiting for a hashing thread before 503
+app.config['LOGIN_ATTEMPTS'] = 5  # Failed attempts per client address ...
+app.config['LOGIN_WINDOW'] = 60  # ... per this many seconds
+app.config['LOGIN_MAX_DELAY'] = 2.0  # Longest gap enforced between attempts on a username failing from many addresses
+app.config['LOGIN_CACHE_TTL'] = 300  # Seconds a verified password skips pbkdf2
+app.config['SERIAL_PORTS'] = [port for port in os.environ.get('SERIAL_PORT', '').split(',') if port]  # Readers on USB serial; none unless SERIAL_PORT is set
+app.config['SERIAL_BAUDRATE'] = 115200
+app.config['SERIAL_DEBOUNCE_SECONDS'] = 5  # Repeat taps of a card within this window are dropped
+app.config['SERIAL_BATCH_ROWS'] = 50  # Serial taps submitted together...
+app.config['SERIAL_BATCH_MS'] = 200  # ...or after this many milliseconds
+app.config['DEVICE_LOCK_FILE'] = os.path.join(app.config['DATABASE_DIR'], 'device.lock')  # Held by the process owning the reader
+app.config['METRICS_DIR'] = os.path.join(app.config['DATABASE_DIR'], 'metrics')  # Per-worker snapshots merged by /metrics
+app.config['METRICS_SHARE_INTERVAL'] = 5  # Seconds between a worker's metrics snapshots
+app.config['ATTENDANCE_GATEWAY'] = os.environ.get('ATTENDANCE_GATEWAY') == '1'  # gateway.py records taps to the same log as the dev server
+app.config['PROFILE_REQUESTS'] = os.environ.get('PROFILE_REQUESTS') == '1'  # cProfile requests (adds overhead)
+app.config['PROFILE_DIR'] = os.path.join(app.config['DATABASE_DIR'], 'profiles')
+app.config['PROFILE_KEEP'] = 20  # Profiles of the slowest requests kept on disk
+app.config['PROFILE_MIN_MS'] = 100  # Faster requests are never dumped
 app.config['SESSION_COOKIE_SECURE'] = True  # Enable in production with HTTPS
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
+app.config['WARM_UP'] = 'background'  # Roster, presence and index loading: 'background' while serving, or 'eager' before create_app returns
 
 # ======================
 # Authentication Setup
@@ -36,161 +97,431 @@ def load_user(user_id):
     return User(user_id)
 
 # ======================
-# Serial Setup
+# Application Factory
 # ======================
-def setup_serial(port='/dev/ttyUSB0', baudrate=115200):
-    """Setup serial communication with ESP32."""
+storage = None
+students = None
+attendance_log = None
+admins_store = None
+attendance_writer = None
+live_feed = None
+password_verifier = None
+absence_job = None
+device_owner = None
+serial_ingestor = None  # Only in the process that owns the device
+presence = None
+reader_keys = None
+data_version = None
+analytics = None  # Created, with pandas, on first use
+warmed = threading.Event()  # Set once the warm-up has run
+metrics = None
+profiler = None  # Only with PROFILE_REQUESTS
+
+# Repository methods timed into attendance_operation_duration_seconds, by operation
+STUDENT_OPERATIONS = {
+    'get': 'roster_lookup', 'all': 'roster_read', 'uids': 'roster_read', 'count': 'roster_read',
+    'add': 'roster_write', 'update': 'roster_write', 'delete': 'roster_write',
+    'add_many': 'roster_write', 'update_many': 'roster_write', 'delete_many': 'roster_write',
+}
+ATTENDANCE_OPERATIONS = {
+    'append': 'attendance_append', 'query': 'attendance_query', 'present_uids': 'attendance_query',
+    'tail': 'attendance_query', 'page': 'attendance_page', 'count_by_date': 'attendance_stats',
+    'changes_since': 'attendance_follow',
+}
+ADMIN_OPERATIONS = {'get': 'admin_lookup', 'all': 'admin_lookup', 'add': 'admin_write'}
+views = ViewCache()
+
+def create_app(config=None):
+    """Configure the app and open its storage and services
+
+    The app and its services are module globals, so there is one per
+    process: only the first call does anything, and later calls return
+    the same app. A later call whose config differs from the settings
+    already in use raises RuntimeError rather than silently ignoring it.
+    Under a preforking server, call it in the master (gunicorn --preload,
+    see wsgi.py) so the roster is loaded once and shared copy-on-write by
+    every worker, then call after_fork() in each worker.
+    """
+    global storage, students, attendance_log, admins_store, attendance_writer
+    global live_feed, password_verifier, absence_job, device_owner, presence, reader_keys, data_version
+    global metrics, profiler
+    if storage is not None:
+        conflicts = sorted(key for key, value in (config or {}).items() if app.config.get(key) != value)
+        if conflicts:
+            raise RuntimeError(f"create_app() already ran with different settings for {', '.join(conflicts)}")
+        return app
+    if config:
+        app.config.update(config)
+
+    metrics = create_metrics()
+    storage = open_storage(app.config)
+    students = TimedRepository(storage.students, metrics, 'attendance_operation_duration_seconds', STUDENT_OPERATIONS)
+    attendance_log = TimedRepository(
+        storage.attendance, metrics, 'attendance_operation_duration_seconds', ATTENDANCE_OPERATIONS)
+    admins_store = TimedRepository(storage.admins, metrics, 'attendance_operation_duration_seconds', ADMIN_OPERATIONS)
+    if app.config['PROFILE_REQUESTS']:
+        profiler = RequestProfiler(
+            app.config['PROFILE_DIR'], keep=app.config['PROFILE_KEEP'], min_ms=app.config['PROFILE_MIN_MS'])
+
+    attendance_writer = AttendanceWriter(
+        attendance_log,
+        mode=app.config['ATTENDANCE_DURABILITY'],
+        max_rows=app.config['ATTENDANCE_FLUSH_ROWS'],
+        max_delay_ms=app.config['ATTENDANCE_FLUSH_MS'],
+        maxsize=app.config['ATTENDANCE_QUEUE_SIZE']
+    )
+    live_feed = LiveFeed(size=app.config['LIVE_FEED_SIZE'])
+    attendance_writer.add_listener(live_feed.publish)
+    data_version = DataVersion(app.config['DATABASE_DIR'])
+    attendance_writer.add_listener(lambda rows: data_version.bump('attendance'))
+    presence = PresenceIndex(attendance_log, window=app.config['ATTENDANCE_DEBOUNCE_SECONDS'])
+    password_verifier = PasswordVerifier(
+        workers=app.config['LOGIN_WORKERS'],
+        max_pending=app.config['LOGIN_QUEUE_SIZE'],
+        attempts=app.config['LOGIN_ATTEMPTS'],
+        window=app.config['LOGIN_WINDOW'],
+        cache_ttl=app.config['LOGIN_CACHE_TTL'],
+        max_delay=app.config['LOGIN_MAX_DELAY']
+    )
+    reader_keys = ReaderKeys(app.config['READERS_FILE'])
+    absence_job = DailyJob('absence-marking', mark_absent_students, at=app.config['ABSENCE_JOB_TIME'],
+                           catch_up_days=app.config['ABSENCE_CATCH_UP_DAYS'])
+    device_owner = DeviceOwner(app.config['DEVICE_LOCK_FILE'], start_device_services)
+
+    atexit.register(attendance_log.save_aggregates)
+    atexit.register(attendance_writer.stop)  # Drain pending rows on shutdown (runs first)
+
+    init_database()
+    if app.config['WARM_UP'] == 'eager':
+        warm_up()
+    else:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    return app
+
+def warm_up():
+    """Load the roster, today's presence and the attendance index ahead of the first requests
+
+    Everything loaded here would otherwise load on first use, so requests
+    served meanwhile are only slower, not wrong.
+    """
+    started = time.perf_counter()
     try:
-        ser = serial.Serial(port, baudrate, timeout=1)
-        return ser
-    except serial.SerialException as e:
-        print(f"Error opening serial port: {e}")
-        return None
+        students.count()
+        presence.warm()
+        attendance_log.page(limit=1)  # Row index of the log
+        get_attendance_stats()  # Daily aggregates behind the dashboard
+        live_feed.seed(attendance_log.tail(app.config['LIVE_FEED_SIZE']))
+        app.logger.info("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
+    except Exception:
+        app.logger.exception("Warm-up failed; data will load on first use")
+    finally:
+        warmed.set()
+
+_analytics_lock = threading.Lock()
 
-# Initialize serial communication
-esp32_serial = setup_serial(port='COM5')  # Adjust the port as necessary
+def get_analytics():
+    """The analytics service, created (and pandas imported) on the first analytics request"""
+    global analytics
+    with _analytics_lock:
+        if analytics is None:
+            from analytics import AttendanceAnalytics
+            analytics = AttendanceAnalytics(
+                attendance_log,
+                late_after=app.config['ANALYTICS_LATE_AFTER'],
+                refresh_interval=app.config['ANALYTICS_REFRESH_SECONDS']
+            )
+    return analytics
+
+def share_log():
+    """Other processes (workers, the gateway) record taps to the same log too"""
+    presence.shared = True
+    # Follow the log for the live view rather than only this process's commits
+    attendance_writer.remove_listener(live_feed.publish)
+    live_feed.follow(attendance_log, interval=app.config['LIVE_FOLLOW_INTERVAL'])
+
+def after_fork():
+    """Reset per-process state in a freshly forked worker"""
+    storage.after_fork()
+    share_log()
+    metrics.share(app.config['METRICS_DIR'], interval=app.config['METRICS_SHARE_INTERVAL'])
+    device_owner.start()
+
+def create_metrics():
+    """Declare the server's metrics and the collectors for values kept by its services"""
+    registry = Metrics()
+    registry.describe('attendance_http_requests_total', 'counter', 'HTTP requests by endpoint, method and status')
+    registry.describe('attendance_http_request_duration_seconds', 'histogram',
+                      'Time to produce a response (up to the first byte for streamed responses)')
+    registry.describe('attendance_operation_duration_seconds', 'histogram',
+                      'Storage, password, analytics and export operations')
+    registry.describe('attendance_writer_queue_depth', 'gauge', 'Attendance rows waiting to be committed')
+    registry.describe('attendance_writer_committed_rows_total', 'counter', 'Attendance rows committed')
+    registry.describe('attendance_writer_commits_total', 'counter', 'Group commits of the attendance writer')
+    registry.describe('attendance_writer_errors_total', 'counter', 'Failed attendance commits')
+    registry.describe('attendance_live_subscribers', 'gauge', 'Open live attendance streams')
+
+    def services():
+        stats = attendance_writer.stats()
+        return [
+            ('attendance_writer_queue_depth', {}, stats['queue_depth']),
+            ('attendance_writer_committed_rows_total', {}, stats['committed_rows']),
+            ('attendance_writer_commits_total', {}, stats['commits']),
+            ('attendance_writer_errors_total', {}, stats['errors']),
+            ('attendance_live_subscribers', {}, live_feed.subscriber_count()),
+        ]
+    registry.add_collector(services)
+    return registry
+
+def start_device_services():
+    """Run in the one process that owns the device: serial readers and daily jobs"""
+    global serial_ingestor
+    absence_job.start()  # First, so a serial setup failure can't stop it
+    if app.config['SERIAL_PORTS']:
+        from serial_ingest import SerialIngestor  # pyserial is only needed by the device owner
+        serial_ingestor = SerialIngestor(
+            app.config['SERIAL_PORTS'],
+            record_serial_taps,
+            baudrate=app.config['SERIAL_BAUDRATE'],
+            debounce=app.config['SERIAL_DEBOUNCE_SECONDS'],
+            batch_size=app.config['SERIAL_BATCH_ROWS'],
+            batch_ms=app.config['SERIAL_BATCH_MS']
+        )
+        serial_ingestor.start()
+        atexit.register(serial_ingestor.stop)
+
+def record_serial_taps(taps):
+    """Record a batch of (uid, timestamp) taps read from USB readers
+
+    Uses the same writer as the HTTP API; queue.Full propagates so the
+    ingestor retries the batch.
+    """
+    for (uid, _), (student, status) in zip(taps, record_taps(taps)):
+        if status == 'unregistered':
+            app.logger.warning("Unregistered card on serial reader: %s", uid)
 
 # ======================
 # Helper Functions
 # ======================
 def init_database():
-    """Initialize database files if they don't exist"""
-    os.makedirs(app.config['DATABASE_DIR'], exist_ok=True)
-    
-    # Students database
-    if not os.path.exists(app.config['STUDENTS_FILE']):
-        with open(app.config['STUDENTS_FILE'], 'w', newline='') as f:
-            f.write("UID,Name,Email,RegisteredDate\n")
-    
-    # Attendance database
-    if not os.path.exists(app.config['ATTENDANCE_FILE']):
-        with open(app.config['ATTENDANCE_FILE'], 'w', newline='') as f:
-            f.write("UID,Name,Timestamp,Status\n")
-    
-    # Admins database
-    if not os.path.exists(app.config['ADMINS_FILE']):
-        with open(app.config['ADMINS_FILE'], 'w', newline='') as f:
-            f.write("Username,PasswordHash\n")
-        # Add default admin if no admins exist
-        with open(app.config['ADMINS_FILE'], 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'admin',
-                generate_password_hash('admin123')  # Change this password!
-            ])
+    """Initialize the storage backend if it doesn't exist"""
+    storage.init()
+    
+    # Add default admin if no admins exist
+    if not admins_store.all():
+        admins_store.add(
+            'admin',
+            generate_password_hash('admin123')  # Change this password!
+        )
 
 def load_admins():
-    """Load admin credentials from file"""
-    admins = {}
-    try:
-        with open(app.config['ADMINS_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                admins[row['Username']] = row['PasswordHash']
-    except FileNotFoundError:
-        pass
-    return admins
+    """Load admin credentials from storage"""
+    return admins_store.all()
 
 def get_today_attendance():
     """Get list of UIDs marked present today"""
-    today = datetime.now().date()
-    present = []
-    try:
-        with open(app.config['ATTENDANCE_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                record_date = datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S').date()
-                if record_date == today and row['Status'] == 'Present':
-                    present.append(row['UID'])
-    except FileNotFoundError:
-        pass
-    return present
-
-def mark_absent_students():
-    """Automatically mark students as absent if they were present yesterday but not today"""
-    today = datetime.now().date()
-    yesterday = today - timedelta(days=1)
-    
-    # Get all students
-    try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            students = [row['UID'] for row in csv.DictReader(f)]
-    except FileNotFoundError:
-        return
+    today = datetime.now().strftime('%Y-%m-%d')
+    return list(attendance_log.present_uids(today))
 
-    # Get present students from yesterday
-    present_yesterday = set()
-    try:
-        with open(app.config['ATTENDANCE_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                record_date = datetime.strptime(row['Timestamp'], '%Y-%m-%d %H:%M:%S').date()
-                if record_date == yesterday and row['Status'] == 'Present':
-                    present_yesterday.add(row['UID'])
-    except FileNotFoundError:
-        return
+_absence_lock = threading.Lock()
+
+def mark_absent_students(day=None):
+    """Mark registered students with no Present row on day (yesterday by default) as absent
+
+    Safe to re-run: students already marked absent for the day are skipped.
+    Days without any taps (weekends, holidays) are left alone. All absences
+    are written in one commit. Returns the number of students marked.
+    """
+    day = day or datetime.now().date() - timedelta(days=1)
+    date = day.strftime('%Y-%m-%d')
+
+    with _absence_lock:
+        # Make sure queued taps are visible before reading the log
+        attendance_writer.flush()
 
-    # Mark absent for students who were present yesterday but not today
-    absent_students = present_yesterday - set(get_today_attendance())
+        present = attendance_log.present_uids(date)
+        if not present:
+            return 0
+        already_marked = {row['UID'] for row in attendance_log.query(date=date, status='Absent (Auto)')}
+        # Students registered after the day weren't expected that day
+        roster = {student['UID']: student['Name'] for student in students.all()
+                  if (student.get('RegisteredDate') or '') <= date}
+        absent = set(roster) - present - already_marked
+
+        timestamp = f'{date} 23:59:59'
+        attendance_writer.submit([
+            {'UID': uid, 'Name': roster[uid], 'Timestamp': timestamp, 'Status': 'Absent (Auto)'}
+            for uid in sorted(absent)
+        ])
+        attendance_writer.flush()
+        return len(absent)
+
+@app.before_request
+def ensure_app_ready():
+    """Open storage and contend for the device under servers that import app directly"""
+    create_app()
+    device_owner.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = profiler.start() if profiler else None
+
+@app.after_request
+def record_request_metrics(response):
+    """Count and time every request; dump its profile if it was profiled"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    metrics.inc('attendance_http_requests_total', endpoint=endpoint, method=request.method,
+                status=str(response.status_code))
+    metrics.observe('attendance_http_request_duration_seconds', elapsed, endpoint=endpoint)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, elapsed, endpoint)
+    return response
+
+def record_tap(uid, timestamp=None):
+    """Record a card tap through the presence index and the writer
+
+    Returns (student, 'new' | 'duplicate'), or (None, 'unregistered').
+    Raises queue.Full when the writer's queue is full.
+    """
+    return record_taps([(uid, timestamp)])[0]
+
+def record_taps(taps):
+    """Record a batch of (uid, timestamp or None) card taps with one writer submit
+
+    Returns (student, status) per tap, as record_tap does. Raises
+    queue.Full when the writer's queue is full; none of the batch is
+    recorded then.
+    """
+    results, rows, claimed = [], [], []
+    for uid, timestamp in taps:
+        student = students.get(uid)
+        if student is None:
+            results.append((None, 'unregistered'))
+            continue
+        
+        # Repeat taps are answered from memory without touching the log
+        timestamp = (timestamp or datetime.now()).replace(microsecond=0)
+        if not presence.claim(uid, timestamp):
+            results.append((student, 'duplicate'))
+            continue
+        claimed.append((uid, timestamp))
+        rows.append({
+            'UID': uid,
+            'Name': student['Name'],
+            'Timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'Status': 'Present'
+        })
+        results.append((student, 'new'))
     
+    # Record attendance (written by the background writer)
     try:
-        with open(app.config['ATTENDANCE_FILE'], 'a', newline='') as f:
-            writer = csv.writer(f)
-            for uid in absent_students:
-                writer.writerow([
-                    uid,
-                    get_student_name(uid),
-                    datetime.now().strftime('%Y-%m-%d 23:59:59'),
-                    'Absent (Auto)'
-                ])
-    except Exception as e:
-        print(f"Error marking absent students: {e}")
+        attendance_writer.submit(rows)
+    except Exception:
+        for uid, timestamp in claimed:
+            presence.release(uid, timestamp)
+        raise
+    return results
 
 def get_student_name(uid):
     """Get student name by UID"""
-    try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['UID'] == uid:
-                    return row['Name']
-    except FileNotFoundError:
-        pass
-    return "Unknown"
-
-def get_attendance_stats(days=7):
-    """Get attendance statistics for the last N days"""
-    stats = []
+    student = students.get(uid)
+    return student['Name'] if student else "Unknown"
+
+def parse_event_timestamp(value):
+    """Parse a reader-supplied timestamp (formatted string or epoch seconds)"""
+    if value is None:
+        return datetime.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value)
+    if isinstance(value, str):
+        timestamp = datetime.fromisoformat(value.replace('T', ' '))
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)  # Server local time
+        return timestamp
+    raise ValueError(f"Unsupported timestamp: {value!r}")
+
+def students_changed():
+    """Invalidate cached pages after a roster write"""
+    data_version.bump('students')
+
+def cached_page(name, depends, render):
+    """Serve a page that only changes when the data in depends changes
+
+    The ETag and Last-Modified come from the data versions (and today's
+    date, since the pages show today's figures), so a browser revalidating
+    an unchanged page gets a 304 without anything being rendered. render()
+    should build the page from views cached at the same versions.
+    """
     today = datetime.now().date()
+    versions = data_version.get(*depends)
+    etag = f"{name}-{today:%Y%m%d}-" + '-'.join(f'{v:x}' for v in versions)
+    midnight = datetime.combine(today, datetime.min.time()).astimezone()
+    last_modified = max([midnight] + [datetime.fromtimestamp(v / 1e9).astimezone() for v in versions])
     
-    try:
-        with open(app.config['ATTENDANCE_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            records = list(reader)
-    except FileNotFoundError:
-        return stats
+    # Pages carrying flash messages are rendered and never stored, or a later
+    # revalidation would get a 304 for the copy showing the messages again
+    if session.get('_flashes'):
+        response = app.make_response(render(versions))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    
+    if request.if_none_match.contains(etag):
+        not_modified = True
+    elif not request.if_none_match and request.if_modified_since:
+        not_modified = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        not_modified = False
+    if not_modified:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    response = app.make_response(render(versions))
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'  # Always revalidate; never in shared caches
+    return response
+
+def get_attendance_stats(days=7, uid=None):
+    """Get attendance statistics for the last N days, optionally for one student"""
+    stats = []
+    today = datetime.now().date()
+    start = today - timedelta(days=days - 1)
+    counts = attendance_log.count_by_date(start.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d'), uid)
     
     for i in range(days):
         date = today - timedelta(days=i)
-        present = 0
-        absent = 0
-        
-        for record in records:
-            record_date = datetime.strptime(record['Timestamp'], '%Y-%m-%d %H:%M:%S').date()
-            if record_date == date:
-                if record['Status'] == 'Present':
-                    present += 1
-                elif 'Absent' in record['Status']:
-                    absent += 1
-        
+        bucket = counts.get(date.strftime('%Y-%m-%d'), {'present': 0, 'absent': 0})
         stats.append({
             'date': date.strftime('%a'),  # Day name (Mon, Tue, etc.)
-            'present': present,
-            'absent': absent
+            'present': bucket['present'],
+            'absent': bucket['absent']
         })
     
     return list(reversed(stats))  # Return oldest to newest
 
+def with_roster_names(rows):
+    """Show each row under the student's current name from the roster
+
+    Compacted partitions keep one name per UID rather than one per tap;
+    rows of students no longer registered keep the logged name.
+    """
+    names = {}
+    for row in rows:
+        uid = row['UID']
+        if uid not in names:
+            student = students.get(uid)
+            names[uid] = student['Name'] if student else None
+        if names[uid]:
+            row['Name'] = names[uid]
+    return rows
+
 # ======================
 # Routes
 # ======================
@@ -211,9 +542,20 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        admins = load_admins()
         
-        if username in admins and check_password_hash(admins[username], password):
+        try:
+            stored_hash = admins_store.get(username)
+            with metrics.timer('attendance_operation_duration_seconds', operation='password_verify'):
+                valid = password_verifier.verify(
+                    username or '', password or '', stored_hash, client=request.remote_addr)
+        except LoginThrottled as e:
+            flash(f'Too many login attempts. Try again in {e.retry_after} seconds.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(e.retry_after)}
+        except VerifierBusy:
+            flash('The server is busy. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
+        
+        if valid:
             user = User(username)
             login_user(user)
             return redirect(url_for('dashboard'))
@@ -231,23 +573,22 @@ def register_admin():
         username = request.form.get('username')
         password = request.form.get('password')
         confirm_password = request.form.get('confirm_password')
-        admins = load_admins()
         
         if password != confirm_password:
             flash('Passwords do not match!', 'error')
             return redirect(url_for('register_admin'))
         
-        if username in admins:
+        if admins_store.get(username) is not None:
             flash('Username already exists!', 'error')
             return redirect(url_for('register_admin'))
         
         # Add new admin
         try:
-            with open(app.config['ADMINS_FILE'], 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([username, generate_password_hash(password)])
+            admins_store.add(username, password_verifier.hash(password))
             flash('Admin registered successfully! Please login.', 'success')
             return redirect(url_for('login'))
+        except VerifierBusy:
+            flash('The server is busy. Please try again in a moment.', 'error')
         except Exception as e:
             flash(f'Error registering admin: {str(e)}', 'error')
     
@@ -265,25 +606,18 @@ def logout():
 def dashboard():
     """Admin dashboard"""
     try:
-        # Initialize with default values
-        present = 0
-        total = 0
-        
-        # Get today's attendance count
-        present = len(get_today_attendance())
-        
-        # Get total student count
-        if os.path.exists(app.config['STUDENTS_FILE']):
-            with open(app.config['STUDENTS_FILE'], 'r') as f:
-                total = sum(1 for _ in csv.DictReader(f))
+        def build():
+            return {
+                'present': len(get_today_attendance()),  # Today's attendance count
+                'total': students.count(),  # Total student count
+                'stats': get_attendance_stats()  # Attendance statistics
+            }
         
-        # Get attendance statistics
-        stats = get_attendance_stats()
+        def render(versions):
+            today = datetime.now().strftime('%Y-%m-%d')
+            return render_template('dashboard.html', **views.get('dashboard', versions + (today,), build))
         
-        return render_template('dashboard.html',
-                            present=present,
-                            total=total,
-                            stats=stats)
+        return cached_page('dashboard', ('attendance', 'students'), render)
     
     except Exception as e:
         flash(f'Error loading dashboard: {str(e)}', 'error')
@@ -305,96 +639,291 @@ def register_with_rfid():
         flash('All fields are required!', 'error')
         return redirect(url_for('dashboard'))
     
-    # Check if UID already exists
-    try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            for row in csv.DictReader(f):
-                if row['UID'] == uid:
-                    flash('Student already registered!', 'error')
-                    return redirect(url_for('dashboard'))
-    except FileNotFoundError:
-        pass
-    
-    # Register new student
+    # Register new student (the registry rejects duplicate UIDs)
     try:
-        with open(app.config['STUDENTS_FILE'], 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([uid, name, email, datetime.now().date()])
-        flash('Student registered successfully!', 'success')
+        if students.add(uid, name, email, datetime.now().date()):
+            students_changed()
+            flash('Student registered successfully!', 'success')
+        else:
+            flash('Student already registered!', 'error')
     except Exception as e:
         flash(f'Error registering student: {str(e)}', 'error')
     
     return redirect(url_for('dashboard'))
 
+def reader_required(view):
+    """Authenticate an RFID reader by its API key (X-Reader-Key or Authorization: Bearer)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('X-Reader-Key')
+        authorization = request.headers.get('Authorization', '')
+        if not key and authorization.startswith('Bearer '):
+            key = authorization[len('Bearer '):]
+        reader_id = reader_keys.reader_for(key)
+        if reader_id is None:
+            return jsonify({"status": "error", "message": "Invalid reader key"}), 401
+        g.reader_id = reader_id
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/api/attendance', methods=['POST'])
+@reader_required
 def record_attendance():
     """API endpoint for recording attendance (called by RFID scanner)"""
-    uid = request.json.get('uid')
+    payload = request.get_json(silent=True)
+    uid = payload.get('uid') if isinstance(payload, dict) else None
     
     if not uid:
         return jsonify({"status": "error", "message": "UID required"}), 400
+    if not isinstance(uid, str):
+        return jsonify({"status": "error", "message": "Invalid UID"}), 400
     
-    # Check registration
-    registered = False
-    name = "Unknown"
     try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            for row in csv.DictReader(f):
-                if row['UID'] == uid:
-                    registered = True
-                    name = row['Name']
-                    break
-    except FileNotFoundError:
-        pass
-    
-    if not registered:
+        student, tap = record_tap(uid)
+    except queue.Full:
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    if student is None:
         return jsonify({"status": "unregistered"}), 404
+    return jsonify({"status": "success", "name": student['Name'], "tap": tap})
+
+@app.route('/api/tap', methods=['POST'])
+@reader_required
+def tap():
+    """API endpoint for readers: look up a card and record it in one round trip
+    
+    Body: {"uid": ...}, or the bare UID as text/plain. Returns the tap
+    status ("new", "duplicate" or "unregistered"), the student's name and
+    the time they were first seen today. Readers that ask for text/plain
+    (Accept header or ?format=text) get one line: "status|name|HH:MM:SS".
+    """
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        uid = payload.get('uid')
+    else:
+        uid = request.get_data(as_text=True).strip()
+    if not uid:
+        return jsonify({"status": "error", "message": "UID required"}), 400
+    if not isinstance(uid, str):
+        return jsonify({"status": "error", "message": "Invalid UID"}), 400
+    
+    try:
+        student, status = record_tap(uid)
+    except queue.Full:
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
     
-    # Record attendance
+    name = student['Name'] if student else ''
+    first_seen = presence.first_seen(uid, datetime.now().strftime('%Y-%m-%d')) if student else None
+    first_seen = first_seen.strftime('%H:%M:%S') if first_seen else ''
+    code = 404 if student is None else 200
+    
+    if request.args.get('format') == 'text' or request.accept_mimetypes.best == 'text/plain':
+        line = '|'.join([status, name.replace('|', '/'), first_seen])
+        return Response(line + '\n', status=code, mimetype='text/plain')
+    return jsonify({"status": status, "name": name, "first_seen": first_seen}), code
+
+@app.route('/api/attendance/batch', methods=['POST'])
+@reader_required
+def record_attendance_batch():
+    """API endpoint for recording a batch of buffered taps in one commit
+    
+    Body: {"events": [{"uid": ..., "timestamp": ..., "reader_id": ...}, ...]}
+    Returns one result per event, in order, so readers can drop the taps
+    that were accepted and retry only the ones that failed.
+    """
+    payload = request.get_json(silent=True)
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    
+    if not isinstance(events, list):
+        return jsonify({"status": "error", "message": "events array required"}), 400
+    if len(events) > app.config['ATTENDANCE_BATCH_LIMIT']:
+        return jsonify({
+            "status": "error",
+            "message": f"At most {app.config['ATTENDANCE_BATCH_LIMIT']} events per batch"
+        }), 413
+    
+    # Validate every event against the student index in one pass
+    results = []
+    taps = []  # (index into results, (uid, timestamp)) of the events that are valid
+    latest = datetime.now() + timedelta(minutes=5)  # Allow for reader clock skew
+    for index, event in enumerate(events):
+        uid = event.get('uid') if isinstance(event, dict) else None
+        result = {"index": index, "uid": uid}
+        if isinstance(event, dict) and 'reader_id' in event:
+            result['reader_id'] = event['reader_id']
+        results.append(result)
+        
+        if not uid:
+            result.update(status="error", message="UID required")
+            continue
+        if not isinstance(uid, str):
+            result.update(status="error", message="Invalid UID")
+            continue
+        try:
+            timestamp = parse_event_timestamp(event.get('timestamp'))
+        except (TypeError, ValueError, OverflowError, OSError):
+            result.update(status="error", message="Invalid timestamp")
+            continue
+        if timestamp > latest:
+            result.update(status="error", message="Timestamp is in the future")
+            continue
+        taps.append((index, (uid, timestamp)))
+    
+    # Record the valid taps as one group for the writer to commit
     try:
-        with open(app.config['ATTENDANCE_FILE'], 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                uid,
-                name,
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'Present'
-            ])
+        recorded = record_taps([tap for _, tap in taps])
+    except queue.Full:
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
     
-    # Auto-mark absent students daily at midnight
-    if datetime.now().hour == 0:  # Runs at midnight
-        mark_absent_students()
+    for (index, _), (student, status) in zip(taps, recorded):
+        if student is None:
+            results[index]['status'] = "unregistered"
+        else:
+            results[index].update(status="success", name=student['Name'], tap=status)
     
-    return jsonify({"status": "success", "name": name})
+    new_taps = sum(1 for _, status in recorded if status == 'new')
+    return jsonify({"status": "success", "recorded": new_taps, "results": results})
 
 @app.route('/api/live_attendance')
 @login_required
 def live_attendance():
     """API endpoint for live attendance data"""
+    # Get the last 10 attendance records, from memory once warm-up has seeded the buffer
+    if not warmed.is_set():
+        return jsonify(attendance_log.tail(10))
+    return jsonify(live_feed.recent(10))
+
+@app.route('/api/live_attendance/stream')
+@login_required
+def live_attendance_stream():
+    """Server-Sent Events stream of attendance rows as they are recorded
+    
+    Each open stream holds a request thread, so only LIVE_MAX_SUBSCRIBERS
+    are served per process; past that the dashboard gets a 503 and polls
+    /api/live_attendance instead, leaving the threads to reader taps.
+    """
+    keepalive = app.config['LIVE_STREAM_KEEPALIVE']
+    subscriber = live_feed.subscribe(limit=app.config['LIVE_MAX_SUBSCRIBERS'])
+    if subscriber is None:
+        return jsonify({"status": "error", "message": "Too many live streams, poll instead"}), 503
+    
+    def events():
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                record = subscriber.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if record is None:  # Dropped for falling behind; client reconnects
+                return
+            yield f"data: {json.dumps(record)}\n\n"
+    
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Don't let a reverse proxy buffer the stream
+    })
+    response.call_on_close(lambda: live_feed.unsubscribe(subscriber))  # Also if the stream never starts
+    return response
+
+@app.route('/api/attendance_stats')
+@login_required
+def attendance_stats():
+    """API endpoint for daily present/absent counts over the last N days"""
+    days = request.args.get('days', 7, type=int)
+    if not 1 <= days <= 366:
+        return jsonify({"error": "days must be between 1 and 366"}), 400
+    return jsonify(get_attendance_stats(days, request.args.get('uid')))
+
+def analytics_range():
+    """Parse ?start=&end= (YYYY-MM-DD) or ?days=N (default 30, ending today)
+
+    Raises ValueError for bad dates or a range longer than ANALYTICS_MAX_DAYS.
+    """
+    end = request.args.get('end')
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else datetime.now().date()
+    start = request.args.get('start')
+    if start:
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+    else:
+        start = end - timedelta(days=request.args.get('days', 30, type=int) - 1)
+    if not 0 <= (end - start).days < app.config['ANALYTICS_MAX_DAYS']:
+        raise ValueError(f"The range must cover 1 to {app.config['ANALYTICS_MAX_DAYS']} days")
+    return start, end
+
+def analytics_report(name, build):
+    """Run an analytics report for the requested range, cached until taps or the roster change"""
     try:
-        # Get the last 10 attendance records
-        with open(app.config['ATTENDANCE_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            records = list(reader)[-10:]  # Get last 10 records
-        
-        return jsonify(records)
-    except FileNotFoundError:
-        return jsonify([])
+        start, end = analytics_range()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    uid = request.args.get('uid')
+    service = get_analytics()
+    service.refresh()
+    version = (service.generation, data_version.get('students'))
+    
+    def timed_build():
+        with metrics.timer('attendance_operation_duration_seconds', operation=f'analytics_{name}'):
+            return build(start, end, uid)
+    return jsonify(views.get(('analytics', name, start, end, uid), version, timed_build))
+
+@app.route('/api/analytics/summary')
+@login_required
+def analytics_summary():
+    """API endpoint for class-wide attendance: average percentage, late arrivals, per-day figures"""
+    return analytics_report('summary', lambda start, end, uid: analytics.summary(students.all(), start, end))
+
+@app.route('/api/analytics/students')
+@login_required
+def analytics_students():
+    """API endpoint for per-student attendance percentage, late arrivals and streaks (?uid= for one)"""
+    def build(start, end, uid):
+        roster = students.all()
+        if uid:
+            roster = [student for student in roster if student['UID'] == uid]
+        return analytics.students(roster, start, end)
+    return analytics_report('students', build)
+
+@app.route('/api/analytics/heatmap')
+@login_required
+def analytics_heatmap():
+    """API endpoint for arrivals by weekday and hour (?uid= for one student)"""
+    return analytics_report('heatmap', lambda start, end, uid: analytics.heatmap(start, end, uid))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics: request counts and latencies, operation timings, writer state"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/writer_status')
+@login_required
+def writer_status():
+    """API endpoint for attendance writer queue depth and commit counters"""
+    return jsonify(attendance_writer.stats())
+
+@app.route('/api/serial_status')
+@login_required
+def serial_status():
+    """API endpoint for USB reader connections and tap counters"""
+    if serial_ingestor is None:
+        return jsonify({"owner": device_owner.is_owner, "ports": {}})
+    return jsonify(dict(serial_ingestor.stats(), owner=True))
 
 @app.route('/students')
 @login_required
 def manage_students():
     """Manage students page"""
-    students = []
-    try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            students = list(csv.DictReader(f))
-    except FileNotFoundError:
-        flash('Students database not found', 'error')
+    def render(versions):
+        # The table is the expensive part; the rest of the page may carry flash messages
+        rows = views.get('student_rows', versions,
+                         lambda: render_template('student_rows.html', students=students.all()))
+        return render_template('students.html', student_rows=Markup(rows))
     
-    return render_template('students.html', students=students)
+    return cached_page('students', ('students',), render)
 
 @app.route('/update_student', methods=['POST'])
 @login_required
@@ -405,25 +934,9 @@ def update_student():
     new_email = request.form['email']
     
     # Update student record
-    updated = False
-    rows = []
     try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            fieldnames = reader.fieldnames
-            for row in reader:
-                if row['UID'] == uid:
-                    row['Name'] = new_name
-                    row['Email'] = new_email
-                    updated = True
-                rows.append(row)
-        
-        if updated:
-            # Write back updated data
-            with open(app.config['STUDENTS_FILE'], 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(rows)
+        if students.update(uid, Name=new_name, Email=new_email):
+            students_changed()
             flash('Student updated successfully!', 'success')
         else:
             flash('Student not found!', 'error')
@@ -435,57 +948,138 @@ def update_student():
 @app.route('/delete_student', methods=['POST'])
 @login_required
 def delete_student():
-    """Delete a student record"""
-    uid = request.form['uid']
+    """Delete one or more student records (every 'uid' field) in one write"""
+    uids = request.form.getlist('uid')
+    if not uids:
+        flash('No students selected!', 'error')
+        return redirect(url_for('manage_students'))
     
     try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            students = [row for row in reader if row['UID'] != uid]
-        
-        with open(app.config['STUDENTS_FILE'], 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['UID', 'Name', 'Email', 'RegisteredDate'])
-            writer.writeheader()
-            writer.writerows(students)
-        
-        flash('Student deleted successfully!', 'success')
+        missing = students.delete_many(uids)
+        if len(missing) < len(uids):
+            students_changed()
+        if len(uids) == 1:
+            if missing:
+                flash('Student not found!', 'error')
+            else:
+                flash('Student deleted successfully!', 'success')
+        else:
+            flash(f'Deleted {len(uids) - len(missing)} students.', 'success')
+            if missing:
+                flash(f'Not found: {", ".join(missing)}', 'error')
     except Exception as e:
         flash(f'Error deleting student: {str(e)}', 'error')
     
     return redirect(url_for('manage_students'))
 
+@app.route('/import_students', methods=['POST'])
+@login_required
+def import_students_upload():
+    """Register students from an uploaded CSV or XLSX file
+    
+    Columns: UID, Name, Email and optionally RegisteredDate. With the
+    'update' field set, rows for registered UIDs update them. Every valid
+    row is written in one go; invalid rows are reported by row number.
+    Returns the report as JSON when the client asks for it (Accept header).
+    """
+    upload = request.files.get('file')
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    if upload is None or not upload.filename:
+        if wants_json:
+            return jsonify({"error": "No file uploaded"}), 400
+        flash('Choose a CSV or Excel file to import!', 'error')
+        return redirect(url_for('manage_students'))
+    
+    import_format = request.args.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if import_format not in IMPORT_FORMATS:
+        if wants_json:
+            return jsonify({"error": f"Unsupported import format: {import_format}"}), 400
+        flash(f'Unsupported import format: {import_format}', 'error')
+        return redirect(url_for('manage_students'))
+    
+    try:
+        report = import_students(students, upload.stream, import_format, datetime.now().date(),
+                                 update=bool(request.form.get('update')))
+    except Exception as e:
+        app.logger.error(f"Import students error: {str(e)}")
+        if wants_json:
+            return jsonify({"error": str(e)}), 400
+        flash(f'Error importing students: {str(e)}', 'error')
+        return redirect(url_for('manage_students'))
+    
+    if report['imported'] or report['updated']:
+        students_changed()
+    if wants_json:
+        return jsonify(report)
+    
+    flash(f"Imported {report['imported']} students, updated {report['updated']}.", 'success')
+    errors = report['errors']
+    if errors:
+        shown = '; '.join(f"row {e['row'] or '-'} ({e['uid'] or 'no UID'}): {e['error']}" for e in errors[:5])
+        more = f' and {len(errors) - 5} more' if len(errors) > 5 else ''
+        flash(f'{len(errors)} rows skipped: {shown}{more}', 'error')
+    return redirect(url_for('manage_students'))
+
+@app.route('/api/students/bulk_update', methods=['POST'])
+@login_required
+def bulk_update_students():
+    """API endpoint for updating many students in one write
+    
+    Body: {"students": [{"uid": ..., "name": ..., "email": ...}, ...]};
+    name and email are each optional.
+    """
+    payload = request.get_json(silent=True) or {}
+    entries = payload.get('students')
+    if not isinstance(entries, list):
+        return jsonify({"error": "Expected {\"students\": [...]}"}), 400
+    
+    updates = {}
+    for entry in entries:
+        given = entry if isinstance(entry, dict) else {}
+        fields = {column: given[key] for key, column in (('name', 'Name'), ('email', 'Email')) if given.get(key)}
+        values = [given.get('uid')] + list(fields.values())
+        if not given.get('uid') or not fields or not all(isinstance(value, str) for value in values):
+            return jsonify({"error": "Each entry needs a uid and a name or email, as strings", "entry": entry}), 400
+        updates[entry['uid']] = fields
+    
+    missing = students.update_many(updates)
+    if len(missing) < len(updates):
+        students_changed()
+    return jsonify({"updated": len(updates) - len(missing), "not_found": missing})
+
+def export_response(export_format, name, sheet_name, columns, chunks):
+    """Stream chunks of rows as a file download in the requested format"""
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    
+    def timed(blocks):
+        # Exports are streamed, so the whole file is timed here rather than in the request
+        with metrics.timer('attendance_operation_duration_seconds', operation=f'export_{export_format}'):
+            yield from blocks
+    
+    return Response(
+        timed(stream_export(export_format, sheet_name, columns, chunks)),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition':
+                f'attachment; filename={name}_{datetime.now().strftime("%Y%m%d")}.{extension}'
+        }
+    )
+
 @app.route('/export_students')
 @login_required
 def export_students():
-    """Export students data to Excel"""
+    """Export students data to Excel (or ?format=csv, csv.gz, ndjson, ndjson.gz)"""
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        flash(f'Unsupported export format: {export_format}', 'error')
+        return redirect(url_for('manage_students'))
+    
     try:
-        # Read student data
-        df = pd.read_csv(app.config['STUDENTS_FILE'])
-        
-        # Create in-memory file
-        output = BytesIO()
-        
-        # Use ExcelWriter with xlsxwriter engine
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Students')
-            
-            # Auto-adjust columns' width
-            worksheet = writer.sheets['Students']
-            for idx, col in enumerate(df.columns):
-                max_len = max((
-                    df[col].astype(str).map(len).max(),  # max in column
-                    len(str(col))  # header length
-                )) + 1
-                worksheet.set_column(idx, idx, max_len)
-        
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'students_{datetime.now().strftime("%Y%m%d")}.xlsx'
-        )
+        # Read student data from the in-memory roster
+        roster = students.all()
+        size = app.config['EXPORT_CHUNK_ROWS']
+        chunks = (roster[i:i + size] for i in range(0, len(roster), size))
+        return export_response(export_format, 'students', 'Students', STUDENT_FIELDS, chunks)
     except Exception as e:
         flash(f'Error exporting student data: {str(e)}', 'error')
         app.logger.error(f"Export students error: {str(e)}")
@@ -494,48 +1088,27 @@ def export_students():
 @app.route('/export_attendance')
 @login_required
 def export_attendance():
-    """Export attendance data to Excel"""
+    """Export attendance data to Excel (or ?format=csv, csv.gz, ndjson, ndjson.gz)"""
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in EXPORT_FORMATS:
+        flash(f'Unsupported export format: {export_format}', 'error')
+        return redirect(url_for('view_attendance'))
+    
     try:
         # Apply filters if any
         date_filter = request.args.get('date')
         status_filter = request.args.get('status')
         uid_filter = request.args.get('uid')
         
-        # Read CSV data
-        df = pd.read_csv(app.config['ATTENDANCE_FILE'])
+        # Read attendance in chunks, filtered by date and UID in storage
+        chunks = attendance_log.iter_chunks(
+            app.config['EXPORT_CHUNK_ROWS'], date=date_filter, uid=uid_filter)
         
-        # Apply filters
-        if date_filter:
-            df = df[df['Timestamp'].str.startswith(date_filter)]
+        # Apply remaining filters per chunk
         if status_filter:
-            df = df[df['Status'].str.contains(status_filter)]
-        if uid_filter:
-            df = df[df['UID'] == uid_filter]
-        
-        # Create in-memory file
-        output = BytesIO()
-        
-        # Use ExcelWriter with xlsxwriter engine
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Attendance')
-            
-            # Auto-adjust columns' width
-            worksheet = writer.sheets['Attendance']
-            for idx, col in enumerate(df.columns):
-                max_len = max((
-                    df[col].astype(str).map(len).max(),  # max in column
-                    len(str(col))  # header length
-                )) + 1
-                worksheet.set_column(idx, idx, max_len)
+            chunks = ([row for row in rows if status_filter in row['Status']] for rows in chunks)
         
-        output.seek(0)
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=f'attendance_{datetime.now().strftime("%Y%m%d")}.xlsx'
-        )
+        return export_response(export_format, 'attendance', 'Attendance', ATTENDANCE_FIELDS, chunks)
     except Exception as e:
         flash(f'Error exporting attendance data: {str(e)}', 'error')
         app.logger.error(f"Export attendance error: {str(e)}")
@@ -544,28 +1117,53 @@ def export_attendance():
 @app.route('/attendance')
 @login_required
 def view_attendance():
-    """View attendance records"""
-    attendance = []
-    try:
-        with open(app.config['ATTENDANCE_FILE'], 'r') as f:
-            attendance = list(csv.DictReader(f))
-        
-        # Apply filters if any
-        date_filter = request.args.get('date')
-        status_filter = request.args.get('status')
-        uid_filter = request.args.get('uid')
-        
-        if date_filter:
-            attendance = [r for r in attendance if r['Timestamp'].startswith(date_filter)]
-        if status_filter:
-            attendance = [r for r in attendance if r['Status'] == status_filter]
-        if uid_filter:
-            attendance = [r for r in attendance if r['UID'] == uid_filter]
-            
-    except FileNotFoundError:
-        flash('Attendance records not found', 'error')
+    """View attendance records, one page at a time"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', app.config['ATTENDANCE_PAGE_SIZE'], type=int), 1),
+                   app.config['ATTENDANCE_MAX_PAGE_SIZE'])
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+    
+    # Apply filters if any
+    filters = {key: request.args[key] for key in ('date', 'status', 'uid') if request.args.get(key)}
+    result = attendance_log.page(
+        date=filters.get('date'),
+        status=filters.get('status'),
+        uid=filters.get('uid'),
+        order=order,
+        limit=per_page,
+        offset=(page - 1) * per_page
+    )
+    pages = max((result['total'] + per_page - 1) // per_page, 1)
     
-    return render_template('attendance.html', attendance=attendance)
+    return render_template('attendance.html',
+                        attendance=with_roster_names(result['rows']),
+                        total=result['total'],
+                        page=page,
+                        pages=pages,
+                        per_page=per_page,
+                        filters=filters)  # For the export links
+
+@app.route('/api/attendance/records')
+@login_required
+def attendance_records():
+    """API endpoint for paginated attendance records
+    
+    Filters: date, status, uid. Paging: limit and either offset or the
+    next_cursor from the previous response. order=asc|desc (default desc).
+    """
+    limit = min(max(request.args.get('limit', app.config['ATTENDANCE_PAGE_SIZE'], type=int), 1),
+                app.config['ATTENDANCE_MAX_PAGE_SIZE'])
+    result = attendance_log.page(
+        date=request.args.get('date'),
+        status=request.args.get('status'),
+        uid=request.args.get('uid'),
+        order='asc' if request.args.get('order') == 'asc' else 'desc',
+        limit=limit,
+        offset=max(request.args.get('offset', 0, type=int), 0),
+        cursor=request.args.get('cursor', type=int)
+    )
+    with_roster_names(result['rows'])
+    return jsonify(result)
 
 @app.route('/api/student_info')
 @login_required
@@ -575,27 +1173,102 @@ def student_info():
     if not uid:
         return jsonify({"error": "UID required"}), 400
     
-    try:
-        with open(app.config['STUDENTS_FILE'], 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['UID'] == uid:
-                    return jsonify({
-                        "uid": uid,
-                        "name": row['Name'],
-                        "email": row['Email'],
-                        "registered_date": row['RegisteredDate']
-                    })
+    row = students.get(uid)
+    if row is None:
         return jsonify({"error": "Student not found"}), 404
-    except FileNotFoundError:
-        return jsonify({"error": "Database not found"}), 500
+    return jsonify({
+        "uid": uid,
+        "name": row['Name'],
+        "email": row['Email'],
+        "registered_date": row['RegisteredDate']
+    })
+
+# ======================
+# CLI Commands
+# ======================
+@app.cli.command('migrate-csv')
+def migrate_csv_command():
+    """Import the CSV database files into the SQLite database"""
+    create_app()
+    students_copied, rows_copied, admins_copied = migrate(
+        CSVStorage(app.config), SQLiteStorage(app.config))
+    print(f"Imported {students_copied} students, {rows_copied} attendance rows "
+          f"and {admins_copied} admins into {app.config['SQLITE_FILE']}")
+    print("Set STORAGE_BACKEND=sqlite to serve from it.")
+
+@app.cli.command('compact-attendance')
+def compact_attendance_command():
+    """Compact attendance partitions older than ATTENDANCE_COMPACT_AFTER_DAYS"""
+    create_app()
+    if not hasattr(attendance_log, 'compact'):
+        print(f"The {storage.name} backend does not partition attendance")
+        return
+    compacted = attendance_log.compact()
+    print(f"Compacted {len(compacted)} partitions" + (f": {', '.join(compacted)}" if compacted else ""))
+
+@app.cli.command('mark-absent')
+@click.option('--date', 'day', type=click.DateTime(['%Y-%m-%d']), default=None,
+              help='Day to close (default: yesterday)')
+def mark_absent_command(day):
+    """Mark students with no attendance on a day as absent"""
+    create_app()
+    marked = mark_absent_students(day.date() if day else None)
+    attendance_writer.stop()
+    print(f"Marked {marked} students absent")
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--update', is_flag=True, help='Update the name and email of students already registered.')
+@click.option('--dry-run', is_flag=True, help='Validate the file without writing anything.')
+def import_students_command(path, update, dry_run):
+    """Register students from a CSV or XLSX file"""
+    create_app()
+    import_format = path.rsplit('.', 1)[-1].lower()
+    with open(path, 'rb') as f:
+        report = import_students(students, f, import_format, datetime.now().date(),
+                                 update=update, dry_run=dry_run)
+    if not dry_run and (report['imported'] or report['updated']):
+        students_changed()
+    for error in report['errors']:
+        print(f"Row {error['row'] or '-'} ({error['uid'] or 'no UID'}): {error['error']}")
+    imported, updated = ('Would import', 'update') if dry_run else ('Imported', 'updated')
+    print(f"{imported} {report['imported']} students and {updated} {report['updated']}; "
+          f"{len(report['errors'])} rows skipped")
+
+@app.cli.command('add-reader')
+@click.argument('reader_id')
+def add_reader_command(reader_id):
+    """Create an API key for an RFID reader (shown once)"""
+    create_app()
+    key = reader_keys.add(reader_id)
+    print(f"API key for {reader_id}: {key}")
+    print("Set readerKey in the reader firmware to this value; it cannot be shown again.")
+
+@app.cli.command('revoke-reader')
+@click.argument('reader_id')
+def revoke_reader_command(reader_id):
+    """Revoke every API key of an RFID reader"""
+    create_app()
+    print(f"Revoked {reader_keys.revoke(reader_id)} keys of {reader_id}")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the daily attendance aggregates from the raw log"""
+    create_app()
+    attendance_log.rebuild_aggregates()
+    print(f"Rebuilt daily attendance aggregates ({storage.name} backend)")
 
 # ======================
 # Main Execution
 # ======================
 if __name__ == '__main__':
-    init_database()
-    # Auto-mark absent students when starting (if it's after midnight)
-    if datetime.now().hour == 0:
-        mark_absent_students()
+    # Development server only; see wsgi.py for serving with several worker processes
+    from werkzeug.serving import WSGIRequestHandler
+
+    create_app()
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # Keep-alive, so readers reuse one connection
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # The reloader's serving process
+        if app.config['ATTENDANCE_GATEWAY']:
+            share_log()
+        device_owner.start()
     app.run(host='127.0.0.1', port=5000, debug=True)
@@ -0,0 +1,1903 @@
+import csv
+import gzip
+import importlib.util
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks then only cover threads of one process
+    fcntl = None
+
+STUDENT_FIELDS = ['UID', 'Name', 'Email', 'RegisteredDate']
+ATTENDANCE_FIELDS = ['UID', 'Name', 'Timestamp', 'Status']
+ADMIN_FIELDS = ['Username', 'PasswordHash']
+
+logger = logging.getLogger(__name__)
+
+
+def read_complete_lines(path, offset):
+    """Return (lines, new_offset) for every complete line from a byte offset.
+
+    A trailing line without its newline is left for the next call, so a
+    reader never sees half of a row that is still being written. The header
+    line is skipped when reading from the start of the file.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    lines = data[:end].decode('utf-8').splitlines()
+    if offset == 0 and lines:
+        lines = lines[1:]
+    return lines, offset + end
+
+
+def read_rows_with_offsets(path, offset):
+    """Return ([(byte_offset, values), ...], new_offset) for complete CSV lines.
+
+    Like read_complete_lines, but keeps the byte offset each row starts at so
+    it can be read back later with a single seek.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    positions, lines = [], []
+    start = 0
+    while start < end:
+        newline = data.index(b'\n', start)
+        if not (offset == 0 and start == 0) and newline > start:  # Skip header and blank lines
+            positions.append(offset + start)
+            lines.append(data[start:newline].decode('utf-8'))
+        start = newline + 1
+    entries = [
+        (position, values)
+        for position, values in zip(positions, csv.reader(lines)) if values
+    ]
+    return entries, offset + end
+
+
+def date_range(start, end):
+    """Yield 'YYYY-MM-DD' strings from start to end inclusive"""
+    day = datetime.strptime(start, '%Y-%m-%d').date()
+    last = datetime.strptime(end, '%Y-%m-%d').date()
+    while day <= last:
+        yield day.strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+# ======================
+# File Locking
+# ======================
+class FileLock:
+    """Advisory lock on a sidecar <path>.lock file, held by threads and processes alike.
+
+    Writers take it exclusively around every mutation. Plain readers don't
+    take it at all: appends are only read up to the last complete line and
+    rewrites are atomic renames, so readers always see a consistent file and
+    never wait on each other. Readers that must see several files in one
+    state take it shared. The sidecar survives the renames of the file it
+    guards, which a lock on the file itself would not.
+    """
+
+    _thread_locks = {}  # Lock path -> threading.Lock, used where fcntl is unavailable
+    _thread_locks_guard = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+        with self._thread_locks_guard:
+            self._thread_lock = self._thread_locks.setdefault(self.path, threading.Lock())
+
+    @contextmanager
+    def _locked(self, operation):
+        if fcntl is None:
+            with self._thread_lock:
+                yield
+            return
+        # A new open file per acquisition, so threads of one process exclude each other too
+        with open(self.path, 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def exclusive(self):
+        return self._locked(fcntl.LOCK_EX if fcntl else None)
+
+    def shared(self):
+        return self._locked(fcntl.LOCK_SH if fcntl else None)
+
+
+@contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """Write to a uniquely named temp file beside path, then rename it over path
+
+    Readers see either the old file or the new one, never a partial write,
+    and concurrent writers never share a temp file.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix=name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def append_csv_rows(path, fields, rows, fsync=False, lock=None):
+    """Append rows under the file's exclusive lock (or the given one), as one write
+
+    The header is written first when the file is new or empty.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writerows(rows)
+    with (lock or FileLock(path)).exclusive():
+        with open(path, 'a', newline='') as f:
+            if f.tell() == 0:
+                csv.writer(f).writerow(fields)
+            f.write(buffer.getvalue())
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+# ======================
+# Repository Interfaces
+# ======================
+class StudentRepository:
+    """Roster of registered students, keyed by UID.
+
+    Rows are dicts with the STUDENT_FIELDS keys.
+    """
+
+    def get(self, uid):
+        """Return the student row for a UID, or None if not registered"""
+        raise NotImplementedError
+
+    def __contains__(self, uid):
+        return self.get(uid) is not None
+
+    def all(self):
+        """Return all student rows in registration order"""
+        raise NotImplementedError
+
+    def uids(self):
+        return {row['UID'] for row in self.all()}
+
+    def count(self):
+        return len(self.all())
+
+    def add(self, uid, name, email, registered_date):
+        """Add a new student; returns False if the UID already exists"""
+        raise NotImplementedError
+
+    def update(self, uid, **fields):
+        """Update fields of an existing student; returns False if not found"""
+        raise NotImplementedError
+
+    def delete(self, uid):
+        """Remove a student; returns False if not found"""
+        raise NotImplementedError
+
+    def add_many(self, rows):
+        """Add new students in one write; returns the UIDs skipped as already registered"""
+        return [row['UID'] for row in rows
+                if not self.add(row['UID'], row['Name'], row['Email'], row['RegisteredDate'])]
+
+    def update_many(self, updates):
+        """Apply {uid: fields} in one write; returns the UIDs not found"""
+        return [uid for uid, fields in updates.items() if not self.update(uid, **fields)]
+
+    def delete_many(self, uids):
+        """Remove students in one write; returns the UIDs not found"""
+        return [uid for uid in uids if not self.delete(uid)]
+
+
+class AttendanceRepository:
+    """Append-only attendance log.
+
+    Rows are dicts with the ATTENDANCE_FIELDS keys; timestamps use the
+    '%Y-%m-%d %H:%M:%S' format, so the first 10 characters are the date.
+    """
+
+    def append(self, rows, fsync=False):
+        """Append a list of rows in one write
+
+        With fsync=True the call returns only once the rows are on disk.
+        """
+        raise NotImplementedError
+
+    def iter_rows(self):
+        """Yield every row, oldest first"""
+        raise NotImplementedError
+
+    def query(self, date=None, status=None, uid=None):
+        """Return rows matching all of the given filters, oldest first"""
+        return [
+            row for row in self.iter_rows()
+            if (not date or row['Timestamp'].startswith(date))
+            and (not status or row['Status'] == status)
+            and (not uid or row['UID'] == uid)
+        ]
+
+    def iter_chunks(self, size, date=None, uid=None):
+        """Yield lists of up to size rows matching the filters, oldest first"""
+        chunk = []
+        for row in self.iter_rows():
+            if (not date or row['Timestamp'].startswith(date)) and (not uid or row['UID'] == uid):
+                chunk.append(row)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def tail(self, n):
+        """Return the last n rows, oldest first"""
+        return list(self.iter_rows())[-n:]
+
+    def changes_since(self, position=None):
+        """Return (rows, position) for rows appended after an opaque position
+
+        position=None starts from the current end of the log. Used to follow
+        rows written by other processes.
+        """
+        raise NotImplementedError
+
+    def page(self, date=None, status=None, uid=None, order='desc', limit=50, offset=0, cursor=None):
+        """Return one page of filtered rows in log order ('asc') or newest first ('desc')
+
+        Pages are addressed either by offset or by the opaque cursor returned
+        as 'next_cursor' from the previous page. Returns
+        {'rows': [...], 'total': matching rows, 'next_cursor': cursor or None}.
+        """
+        rows = self.query(date, status, uid)
+        return paginate(range(len(rows)), lambda selected: [rows[i] for i in selected],
+                        order, limit, offset, cursor)
+
+    def present_uids(self, date):
+        """Return the set of UIDs marked Present on a 'YYYY-MM-DD' date"""
+        return {
+            row['UID'] for row in self.iter_rows()
+            if row['Timestamp'][:10] == date and row['Status'] == 'Present'
+        }
+
+    def count_by_date(self, start, end, uid=None):
+        """Return {date: {'present': n, 'absent': m}} for start <= date <= end
+
+        Only dates with at least one row are included. With a UID, only that
+        student's rows are counted.
+        """
+        aggregates = DailyAggregates()
+        aggregates.apply(
+            row for row in self.iter_rows()
+            if start <= row['Timestamp'][:10] <= end and (not uid or row['UID'] == uid)
+        )
+        return aggregates.counts(start, end, uid)
+
+    def rebuild_aggregates(self):
+        """Recompute any stored daily aggregates from the raw log"""
+
+    def save_aggregates(self):
+        """Persist any aggregates held in memory"""
+
+
+def paginate(numbers, fetch, order='desc', limit=50, offset=0, cursor=None):
+    """Slice one page out of a sorted sequence of row numbers
+
+    fetch(row_numbers) returns the rows for the selected numbers, in order.
+    A cursor is the last row number of the previous page.
+    """
+    total = len(numbers)
+    if order == 'asc':
+        start = bisect_right(numbers, cursor) if cursor is not None else offset
+        selected = [numbers[i] for i in range(start, min(start + limit, total))]
+        more = start + limit < total
+    else:
+        end = bisect_left(numbers, cursor) if cursor is not None else total - offset
+        selected = [numbers[i] for i in range(max(end, 0) - 1, max(end - limit, 0) - 1, -1)]
+        more = end - limit > 0
+    return {
+        'rows': fetch(selected),
+        'total': total,
+        'next_cursor': selected[-1] if more and selected else None,
+    }
+
+
+class DailyAggregates:
+    """Present/absent counts per date, and per UID within each date.
+
+    Maintained incrementally from appended rows so range queries cost
+    O(days) dictionary lookups instead of a scan of the log.
+    """
+
+    def __init__(self, by_date=None, by_uid=None):
+        self.by_date = by_date or {}  # date -> [present, absent]
+        self.by_uid = by_uid or {}    # date -> {uid: [present, absent]}
+
+    def apply(self, rows):
+        for row in rows:
+            status = row['Status']
+            if status == 'Present':
+                column = 0
+            elif 'Absent' in status:
+                column = 1
+            else:
+                continue
+            date = row['Timestamp'][:10]
+            self.by_date.setdefault(date, [0, 0])[column] += 1
+            self.by_uid.setdefault(date, {}).setdefault(row['UID'], [0, 0])[column] += 1
+
+    def counts(self, start, end, uid=None):
+        counts = {}
+        for date in date_range(start, end):
+            if uid:
+                bucket = self.by_uid.get(date, {}).get(uid)
+            else:
+                bucket = self.by_date.get(date)
+            if bucket:
+                counts[date] = {'present': bucket[0], 'absent': bucket[1]}
+        return counts
+
+    def to_dict(self):
+        return {'by_date': self.by_date, 'by_uid': self.by_uid}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['by_date'], data['by_uid'])
+
+
+class AdminRepository:
+    """Admin credentials, keyed by username."""
+
+    def all(self):
+        """Return {username: password_hash}"""
+        raise NotImplementedError
+
+    def get(self, username):
+        """Return the password hash for username, or None"""
+        return self.all().get(username)
+
+    def add(self, username, password_hash):
+        raise NotImplementedError
+
+# ======================
+# CSV Backend
+# ======================
+class CSVStudentRepository(StudentRepository):
+    """In-memory index of the students file keyed by UID.
+
+    The file is parsed once and then re-read only when its mtime or size
+    changes. Appends are picked up incrementally from the last byte offset
+    read; any other change triggers a full reload. Writes made through the
+    repository update the index in place, so lookups never touch the disk.
+    """
+    CHECK_INTERVAL = 1.0  # Seconds between stat() checks for external edits
+
+    def __init__(self, path):
+        self.path = path
+        self._file_lock = FileLock(path)
+        self._students = {}
+        self._lock = threading.RLock()
+        self._signature = None  # (inode, mtime_ns, size) of the indexed file
+        self._offset = 0        # Bytes of the file already indexed
+        self._checked_at = 0.0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.CHECK_INTERVAL:
+            return
+        self._checked_at = now
+
+        signature = self._stat()
+        if signature == self._signature:
+            return
+        if signature is None:
+            self._students = {}
+            self._signature = None
+            self._offset = 0
+            return
+
+        appended = (
+            self._signature is not None
+            and signature[0] == self._signature[0]
+            and signature[2] > self._offset
+        )
+        if appended:
+            self._read_from(self._offset)
+        else:
+            self._students = {}
+            self._read_from(0)
+        self._signature = signature
+
+    def _read_from(self, offset):
+        """Index every complete line of the file from the given byte offset"""
+        lines, self._offset = read_complete_lines(self.path, offset)
+        for values in csv.reader(lines):
+            if not values:
+                continue
+            row = dict(zip(STUDENT_FIELDS, values))
+            self._students[row['UID']] = row
+
+    def _rewrite(self):
+        """Write the whole index back to disk after an update or delete"""
+        with atomic_write(self.path, newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=STUDENT_FIELDS)
+            writer.writeheader()
+            writer.writerows(self._students.values())
+        self._mark_synced()
+
+    def _mark_synced(self):
+        self._signature = self._stat()
+        self._offset = self._signature[2] if self._signature else 0
+
+    def get(self, uid):
+        with self._lock:
+            self._refresh()
+            row = self._students.get(uid)
+            return dict(row) if row else None
+
+    def __contains__(self, uid):
+        with self._lock:
+            self._refresh()
+            return uid in self._students
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return [dict(row) for row in self._students.values()]
+
+    def uids(self):
+        with self._lock:
+            self._refresh()
+            return set(self._students)
+
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._students)
+
+    # Mutations re-read the file under its exclusive lock, so changes made by
+    # other processes since the last refresh are never overwritten
+
+    def add(self, uid, name, email, registered_date):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            if uid in self._students:
+                return False
+            row = dict(zip(STUDENT_FIELDS, [uid, name, email, str(registered_date)]))
+            with open(self.path, 'a', newline='') as f:
+                csv.writer(f).writerow(row.values())
+            self._students[uid] = row
+            self._mark_synced()
+            return True
+
+    def update(self, uid, **fields):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            if uid not in self._students:
+                return False
+            self._students[uid].update(fields)
+            self._rewrite()
+            return True
+
+    def delete(self, uid):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            if self._students.pop(uid, None) is None:
+                return False
+            self._rewrite()
+            return True
+
+    def add_many(self, rows):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            skipped, added = [], {}
+            for row in rows:
+                if row['UID'] in self._students or row['UID'] in added:
+                    skipped.append(row['UID'])
+                else:
+                    added[row['UID']] = {field: str(row[field]) for field in STUDENT_FIELDS}
+            if added:
+                with open(self.path, 'a', newline='') as f:
+                    csv.writer(f).writerows(row.values() for row in added.values())
+                self._students.update(added)
+                self._mark_synced()
+            return skipped
+
+    def update_many(self, updates):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            missing = [uid for uid in updates if uid not in self._students]
+            if len(missing) < len(updates):
+                for uid, fields in updates.items():
+                    if uid in self._students:
+                        self._students[uid].update(fields)
+                self._rewrite()
+            return missing
+
+    def delete_many(self, uids):
+        with self._lock, self._file_lock.exclusive():
+            self._refresh(force=True)
+            missing = [uid for uid in uids if self._students.pop(uid, None) is None]
+            if len(missing) < len(uids):
+                self._rewrite()
+            return missing
+
+
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+class AttendanceColumns:
+    """Attendance rows held as parallel columns of small numbers.
+
+    UIDs and statuses are interned to integer codes and timestamps are
+    kept as seconds since 1970-01-01 of their wall-clock time, so a row
+    costs 13 bytes instead of a dict of four strings. Names are kept once
+    per UID (the latest seen), not per row. The columns are arrays, so
+    appending taps is cheap, and filters run as NumPy masks over them.
+
+    Timestamps come back in the '%Y-%m-%d %H:%M:%S' format; one that
+    can't be parsed is kept as midnight of its date, or of 1970-01-01.
+    """
+
+    def __init__(self):
+        self.uids = []                  # UID code -> UID
+        self.names = []                 # UID code -> latest name
+        self.statuses = []              # Status code -> status
+        self.uid_codes = array('I')     # Row number -> UID code
+        self.status_codes = array('B')  # Row number -> status code
+        self.seconds = array('q')       # Row number -> timestamp
+        self._uid_index = {}            # UID -> code
+        self._days = {}                 # 'YYYY-MM-DD' -> seconds at midnight
+        self._lock = threading.Lock()   # Arrays can't grow while a NumPy view of them is alive
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the row columns"""
+        return sum(column.itemsize * len(column) for column in (self.uid_codes, self.status_codes, self.seconds))
+
+    def _midnight(self, day):
+        midnight = self._days.get(day)
+        if midnight is None:
+            try:
+                midnight = (datetime.strptime(day, '%Y-%m-%d').toordinal() - EPOCH_ORDINAL) * 86400
+            except ValueError:
+                return 0
+            self._days[day] = midnight
+        return midnight
+
+    def _to_seconds(self, timestamp):
+        midnight = self._midnight(timestamp[:10])
+        try:
+            return midnight + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+        except ValueError:
+            return midnight
+
+    def extend(self, rows):
+        """Append rows given as [UID, Name, Timestamp, Status] sequences"""
+        uid_index, names, statuses = self._uid_index, self.names, self.statuses
+        with self._lock:
+            for uid, name, timestamp, status in rows:
+                code = uid_index.get(uid)
+                if code is None:
+                    code = uid_index[uid] = len(self.uids)
+                    self.uids.append(uid)
+                    names.append(name)
+                else:
+                    names[code] = name
+                if status not in statuses:
+                    statuses.append(status)
+                self.uid_codes.append(code)
+                self.status_codes.append(statuses.index(status))
+                self.seconds.append(self._to_seconds(timestamp))
+
+    def rows(self, numbers):
+        """Return the rows with the given row numbers as dicts, in the order given"""
+        uid_codes, status_codes, seconds = self.uid_codes, self.status_codes, self.seconds
+        return [
+            {
+                'UID': self.uids[uid_codes[n]],
+                'Name': self.names[uid_codes[n]],
+                'Timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds[n])),
+                'Status': self.statuses[status_codes[n]],
+            }
+            for n in numbers
+        ]
+
+    def _mask(self, date, status, uid):
+        """Boolean mask of the rows matching all of the filters, or None if none can"""
+        import numpy as np  # Loaded with the first filtered read
+
+        mask = np.ones(len(self.seconds), dtype=bool)
+        if uid:
+            code = self._uid_index.get(uid)
+            if code is None:
+                return None
+            mask &= np.frombuffer(self.uid_codes, dtype=np.uint32) == code
+        if status:
+            if status not in self.statuses:
+                return None
+            mask &= np.frombuffer(self.status_codes, dtype=np.uint8) == self.statuses.index(status)
+        if date:
+            # Partial dates ('2025-05') cover several days
+            days = [midnight // 86400 for day, midnight in self._days.items() if day.startswith(date)]
+            if not days:
+                return None
+            day_numbers = np.frombuffer(self.seconds, dtype=np.int64) // 86400
+            if len(days) == 1:
+                mask &= day_numbers == days[0]
+            else:
+                mask &= np.isin(day_numbers, days)
+        return mask
+
+    def select(self, date=None, status=None, uid=None):
+        """Return the sorted row numbers matching all of the given filters"""
+        with self._lock:
+            if not (date or status or uid):
+                return range(len(self.seconds))
+            if not self.seconds:
+                return []
+            mask = self._mask(date, status, uid)
+            return [] if mask is None else mask.nonzero()[0].tolist()
+
+    def count(self, date=None, status=None, uid=None):
+        with self._lock:
+            if not (date or status or uid) or not self.seconds:
+                return len(self.seconds)
+            mask = self._mask(date, status, uid)
+            return 0 if mask is None else int(mask.sum())
+
+    def present_uids(self, date):
+        """Return the set of UIDs marked Present on a 'YYYY-MM-DD' date"""
+        import numpy as np
+
+        with self._lock:
+            mask = self._mask(date, 'Present', None) if self.seconds else None
+            if mask is None:
+                return set()
+            codes = np.unique(np.frombuffer(self.uid_codes, dtype=np.uint32)[mask])
+            return {self.uids[code] for code in codes.tolist()}
+
+
+class AttendanceIndex:
+    """Byte offset and compact columns of every row in the attendance log.
+
+    Row numbers are positions in the log, so selections come back sorted
+    and a page of results can be read back with one seek per row.
+    """
+
+    def __init__(self):
+        self.offset = 0                # Bytes of the log covered by the index
+        self.inode = None              # Inode of the indexed log
+        self.positions = array('Q')    # Row number -> byte offset in the log
+        self.columns = AttendanceColumns()
+
+    def add(self, entries):
+        self.columns.extend(values[:4] for _, values in entries)
+        self.positions.extend(position for position, _ in entries)
+
+    def select(self, date=None, status=None, uid=None):
+        """Return the sorted row numbers matching all of the given filters"""
+        return self.columns.select(date, status, uid)
+
+
+class CSVAttendanceRepository(AttendanceRepository):
+    """Attendance log in a single CSV file.
+
+    Daily aggregates are kept in memory together with the byte offset of
+    the log they cover, and caught up by reading only the bytes past that
+    offset - including rows appended by other processes. They are saved to
+    stats_path periodically and at rebuild, so a restart only replays the
+    tail of the log. The row index used for paging is caught up the same
+    way, but is rebuilt from the log on first use rather than saved.
+
+    With stats_path=None the aggregates are never saved; the partitioned
+    log uses that for its per-day segments, which are cheap to replay.
+    Appends hold lock (by default a FileLock on path) exclusively.
+    """
+    SAVE_INTERVAL = 60  # Seconds between aggregate snapshots
+    TAIL_BLOCK = 8192   # Bytes read per step when seeking back from the end
+
+    def __init__(self, path, stats_path, lock=None):
+        self.path = path
+        self.stats_path = stats_path
+        self._file_lock = lock or FileLock(path)
+        self._lock = threading.RLock()
+        self._aggregates = None  # Loaded on first use
+        self._offset = 0         # Bytes of the log covered by the aggregates
+        self._inode = None       # Inode of the log the aggregates were read from
+        self._saved_at = 0.0
+        self._index = None       # Built on first use
+
+    def append(self, rows, fsync=False):
+        append_csv_rows(self.path, ATTENDANCE_FIELDS, rows, fsync=fsync, lock=self._file_lock)
+
+        with self._lock:
+            if self._aggregates is not None:
+                self._catch_up()
+                if time.monotonic() - self._saved_at >= self.SAVE_INTERVAL:
+                    self.save_aggregates()
+            if self._index is not None:
+                self._catch_up_index()
+
+    def changes_since(self, position=None):
+        inode, size = self._stat()
+        if position is None or position[0] != inode or size < position[1]:
+            return [], (inode, size)  # New or replaced log: follow from its end
+        if size == position[1]:
+            return [], position
+        lines, offset = read_complete_lines(self.path, position[1])
+        rows = [dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines) if values]
+        return rows, (inode, offset)
+
+    def tail(self, n):
+        """Return the last n rows by reading backwards from the end of the file"""
+        try:
+            with open(self.path, 'rb') as f:
+                position = f.seek(0, os.SEEK_END)
+                data = b''
+                while position > 0 and data.count(b'\n') <= n + 1:
+                    step = min(self.TAIL_BLOCK, position)
+                    position -= step
+                    f.seek(position)
+                    data = f.read(step) + data
+        except FileNotFoundError:
+            return []
+
+        # Drop the header or the partial first line, and any unfinished last line
+        data = data[data.find(b'\n') + 1:data.rfind(b'\n') + 1]
+        lines = data.decode('utf-8').splitlines()[-n:] if n > 0 else []
+        return [dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines) if values]
+
+    def _load_aggregates(self):
+        try:
+            if self.stats_path is None:
+                raise FileNotFoundError
+            with open(self.stats_path, 'r') as f:
+                snapshot = json.load(f)
+            aggregates = DailyAggregates.from_dict(snapshot)
+            offset = snapshot['offset']
+        except (FileNotFoundError, ValueError, KeyError):
+            aggregates, offset = DailyAggregates(), 0
+        if offset > self._size():
+            aggregates, offset = DailyAggregates(), 0  # Log was truncated or replaced
+        self._aggregates, self._offset = aggregates, offset
+        self._catch_up()
+
+    def _size(self):
+        return self._stat()[1]
+
+    def _stat(self):
+        """Return (inode, size) of the log, or (None, 0) if it doesn't exist"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _catch_up(self):
+        """Apply rows appended to the log since the aggregates were last updated"""
+        inode, size = self._stat()
+        if size < self._offset or (self._inode is not None and inode != self._inode):
+            self._aggregates, self._offset = DailyAggregates(), 0  # Log was replaced
+        self._inode = inode
+        if size == self._offset:
+            return
+        lines, self._offset = read_complete_lines(self.path, self._offset)
+        self._aggregates.apply(
+            dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines) if values
+        )
+
+    def _catch_up_index(self):
+        """Index rows appended to the log since the index was last updated"""
+        inode, size = self._stat()
+        if self._index is None or size < self._index.offset or inode != self._index.inode:
+            self._index = AttendanceIndex()
+            self._index.inode = inode
+        if size == self._index.offset:
+            return
+        entries, self._index.offset = read_rows_with_offsets(self.path, self._index.offset)
+        self._index.add(entries)
+
+    def _read_at(self, positions):
+        """Read the rows starting at each of the given byte offsets"""
+        lines = []
+        with open(self.path, 'rb') as f:
+            for position in positions:
+                f.seek(position)
+                lines.append(f.readline().decode('utf-8'))
+        return [dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines)]
+
+    def select(self, date=None, status=None, uid=None):
+        """Return the sorted row numbers matching the filters, from the index"""
+        with self._lock:
+            self._catch_up_index()
+            return self._index.select(date, status, uid)
+
+    def fetch(self, numbers):
+        """Read the rows with the given row numbers, in the order given"""
+        with self._lock:
+            positions = [self._index.positions[n] for n in numbers]
+        return self._read_at(positions)
+
+    def page(self, date=None, status=None, uid=None, order='desc', limit=50, offset=0, cursor=None):
+        return paginate(self.select(date, status, uid), self.fetch, order, limit, offset, cursor)
+
+    def query(self, date=None, status=None, uid=None):
+        if not (date or status or uid):
+            return list(self.iter_rows())
+        return self.fetch(self.select(date, status, uid))
+
+    def present_uids(self, date):
+        with self._lock:
+            self._catch_up_index()
+            return self._index.columns.present_uids(date)
+
+    def save_aggregates(self):
+        with self._lock:
+            if self._aggregates is None or self.stats_path is None:
+                return
+            snapshot = self._aggregates.to_dict()
+            snapshot['offset'] = self._offset
+            with atomic_write(self.stats_path) as f:
+                json.dump(snapshot, f)
+            self._saved_at = time.monotonic()
+
+    def count_by_date(self, start, end, uid=None):
+        with self._lock:
+            if self._aggregates is None:
+                self._load_aggregates()
+            else:
+                self._catch_up()
+            return self._aggregates.counts(start, end, uid)
+
+    def rebuild_aggregates(self):
+        with self._lock:
+            self._aggregates, self._offset = DailyAggregates(), 0
+            self._catch_up()
+            self.save_aggregates()
+
+    def iter_rows(self):
+        try:
+            with open(self.path, 'r', newline='') as f:
+                yield from csv.DictReader(f)
+        except FileNotFoundError:
+            return
+
+
+# ======================
+# Partitioned CSV Attendance Log
+# ======================
+PARTITION_KEY_LENGTH = {'day': 10, 'month': 7}
+SEGMENT_NAME = re.compile(r'^(\d{4}-\d{2}(?:-\d{2})?)\.csv$')
+
+
+def default_compact_format():
+    """Parquet when pyarrow is installed, gzipped CSV otherwise"""
+    if importlib.util.find_spec('pyarrow'):
+        return 'parquet'
+    logger.warning("pyarrow is not installed; compacting attendance to csv.gz instead of Parquet")
+    return 'csv.gz'
+
+
+def _write_compacted(path, compact_format, rows):
+    with atomic_write(path, 'wb') as f:
+        if compact_format == 'parquet':
+            import pandas as pd
+            df = pd.DataFrame(rows, columns=ATTENDANCE_FIELDS)
+            for column in ('UID', 'Name', 'Status'):
+                df[column] = df[column].astype('category')  # Stored dictionary-encoded
+            df.to_parquet(f, index=False)
+        else:
+            with gzip.open(f, 'wt', newline='') as gz:
+                writer = csv.DictWriter(gz, fieldnames=ATTENDANCE_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+
+
+def _iter_compacted(path, compact_format):
+    """Yield the rows of a compacted segment as stored, as [UID, Name, Timestamp, Status] values"""
+    if compact_format == 'parquet':
+        import pandas as pd
+        df = pd.read_parquet(path, columns=ATTENDANCE_FIELDS)
+        for values in df.itertuples(index=False, name=None):
+            yield [str(value) for value in values]
+        return
+    with gzip.open(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Header
+        yield from (values for values in reader if values)
+
+
+def _read_compacted(path, compact_format):
+    """Read a compacted segment into AttendanceColumns"""
+    columns = AttendanceColumns()
+    columns.extend(_iter_compacted(path, compact_format))
+    return columns
+
+
+def _read_csv_prefix(path, size):
+    """Return the rows in the first size bytes of a CSV segment"""
+    with open(path, 'rb') as f:
+        lines = f.read(size).decode('utf-8').splitlines()[1:]
+    return [dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines) if values]
+
+
+def _drop_csv_prefix(path, size, lock):
+    """Remove the first size bytes of rows from a CSV segment, keeping its header"""
+    with lock.exclusive():
+        with open(path, 'rb') as f:
+            header = f.readline()
+            f.seek(size)
+            rest = f.read()
+        if not rest:
+            os.remove(path)
+            return
+        with atomic_write(path, 'wb') as f:
+            f.write(header + rest)
+
+
+class PartitionedAttendanceRepository(AttendanceRepository):
+    """Attendance log split into one segment per day (or per month).
+
+    Layout of the directory:
+      <key>.csv               rows appended to the partition
+      <key>.<gen>.parquet     compacted rows (<key>.<gen>.csv.gz without pyarrow)
+      <key>.<gen>.stats.json  per-UID and per-status counts of the compacted rows
+      manifest.json           compacted segments with their row and daily counts
+
+    Appends lock only their segment. Compaction commits the manifest and
+    trims the merged CSV under the exclusive manifest lock; readers of a
+    partition hold it shared while they read, so they see the partition
+    either before or after a compaction, never half of each.
+
+    Queries only open the partitions their date filter can match, so
+    today's attendance never reads past today's segment. When the log
+    rotates to a new partition, partitions older than compact_after_days
+    are compacted in the background. Rows that arrive late for a compacted
+    partition start a new <key>.csv and are merged at the next compaction.
+    """
+    MANIFEST = 'manifest.json'
+    CACHE_SIZE = 400  # Compacted segments kept in memory as AttendanceColumns
+
+    def __init__(self, directory, partition='day', compact_after_days=7, compact_format=None):
+        if partition not in PARTITION_KEY_LENGTH:
+            raise ValueError(f"Unknown attendance partition: {partition}")
+        self.directory = directory
+        self.partition = partition
+        self.key_length = PARTITION_KEY_LENGTH[partition]
+        self.compact_after_days = compact_after_days
+        if compact_format not in (None, 'parquet', 'csv.gz'):
+            raise ValueError(f"Unknown attendance compaction format: {compact_format}")
+        self.compact_format = compact_format or default_compact_format()
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._manifest_lock = FileLock(self._path(self.MANIFEST))
+        self._compaction_lock = FileLock(self._path('compaction'))  # One compacting process at a time
+        self._append_lock = FileLock(self._path('segments'))  # Shared by every segment's appends
+        self._manifest = None
+        self._manifest_signature = None
+        self._segments = {}  # key -> CSVAttendanceRepository for <key>.csv
+        self._keys = None
+        self._keys_signature = None
+        self._cache = OrderedDict()  # compacted file name -> AttendanceColumns
+
+    # ---- Layout ----
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _csv_path(self, key):
+        return self._path(f'{key}.csv')
+
+    def _load_manifest(self):
+        """Return the manifest, re-read whenever another process has replaced it"""
+        path = self._path(self.MANIFEST)
+        try:
+            st = os.stat(path)
+            signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        if self._manifest is not None and signature == self._manifest_signature:
+            return self._manifest
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {'version': 1, 'partition': self.partition, 'segments': {}}
+        if manifest['partition'] != self.partition:
+            raise ValueError(
+                f"{self.directory} is partitioned by {manifest['partition']}, not {self.partition}")
+        self._manifest, self._manifest_signature = manifest, signature
+        return manifest
+
+    def _save_manifest(self):
+        """Replace the manifest; callers hold the exclusive manifest lock"""
+        with atomic_write(self._path(self.MANIFEST)) as f:
+            json.dump(self._manifest, f)
+        self._manifest_signature = None  # Re-read (cheaply) rather than trust mtime granularity
+
+    def recover(self):
+        """Finish compactions interrupted between the manifest commit and the CSV cleanup"""
+        if not os.path.isdir(self.directory):
+            return
+        with self._manifest_lock.exclusive(), self._lock:
+            manifest = self._load_manifest()
+            interrupted = {key: meta for key, meta in manifest['segments'].items() if meta.get('csv_merged')}
+            for key, meta in interrupted.items():
+                path = self._csv_path(key)
+                if os.path.exists(path) and os.path.getsize(path) >= meta['csv_merged']:
+                    _drop_csv_prefix(path, meta['csv_merged'], self._append_lock)
+                del meta['csv_merged']
+            if interrupted:
+                self._save_manifest()
+
+    def keys(self):
+        """Return every partition key with data, oldest first"""
+        with self._lock:
+            manifest = self._load_manifest()
+            try:
+                signature = os.stat(self.directory).st_mtime_ns
+            except FileNotFoundError:
+                return sorted(manifest['segments'])
+            if self._keys is None or signature != self._keys_signature:
+                names = os.listdir(self.directory)
+                found = {m.group(1) for m in map(SEGMENT_NAME.match, names) if m}
+                self._keys = sorted(found | set(manifest['segments']))
+                self._keys_signature = signature
+            return list(self._keys)
+
+    def _matching_keys(self, date):
+        """Partitions that can hold rows whose timestamp starts with date"""
+        keys = self.keys()
+        if not date:
+            return keys
+        return [key for key in keys if key.startswith(date) or date.startswith(key)]
+
+    def _overlapping_keys(self, start, end):
+        return [key for key in self.keys() if start[:len(key)] <= key <= end[:len(key)]]
+
+    def _segment(self, key):
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is None:
+                segment = self._segments[key] = CSVAttendanceRepository(
+                    self._csv_path(key), None, lock=self._append_lock)
+            return segment
+
+    def _has_csv(self, key):
+        return os.path.exists(self._csv_path(key))
+
+    def _compacted_columns(self, key, meta=None):
+        with self._lock:
+            meta = meta or self._load_manifest()['segments'].get(key)
+            if meta is None:
+                return AttendanceColumns()
+            columns = self._cache.get(meta['file'])
+            if columns is not None:
+                self._cache.move_to_end(meta['file'])
+                return columns
+        columns = _read_compacted(self._path(meta['file']), meta['format'])
+        with self._lock:
+            self._cache[meta['file']] = columns
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return columns
+
+    def _compacted_rows(self, key, meta=None):
+        columns = self._compacted_columns(key, meta)
+        return columns.rows(range(len(columns)))
+
+    def _compacted_stats(self, key):
+        meta = self._load_manifest()['segments'][key]
+        with open(self._path(meta['stats']), 'r') as f:
+            return json.load(f)
+
+    def _partition_rows(self, key):
+        """Return every row of a partition, as of one manifest state"""
+        with self._manifest_lock.shared():
+            with self._lock:
+                meta = self._load_manifest()['segments'].get(key)
+            rows = self._compacted_rows(key, meta) if meta else []
+            if self._has_csv(key):
+                if meta and meta.get('csv_merged'):
+                    # Compaction was interrupted; skip the rows it already merged
+                    lines, _ = read_complete_lines(self._csv_path(key), meta['csv_merged'])
+                    rows += [dict(zip(ATTENDANCE_FIELDS, values)) for values in csv.reader(lines) if values]
+                else:
+                    rows += self._segment(key).iter_rows()
+        return rows
+
+    # ---- Writes ----
+
+    def append(self, rows, fsync=False):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row['Timestamp'][:self.key_length], []).append(row)
+
+        with self._lock:
+            existing = self.keys()
+            os.makedirs(self.directory, exist_ok=True)
+            for key, group in groups.items():
+                self._segment(key).append(group, fsync=fsync)
+            rotated = bool(existing) and max(groups) > existing[-1]
+
+        if rotated:
+            threading.Thread(target=self.compact, name='attendance-compaction', daemon=True).start()
+
+    def compact(self, today=None):
+        """Compact every partition that ended more than compact_after_days ago
+
+        Returns the keys that were compacted.
+        """
+        today = today or datetime.now().date()
+        cutoff = (today - timedelta(days=self.compact_after_days)).strftime('%Y-%m-%d')[:self.key_length]
+        compacted = []
+        with self._compact_lock, self._compaction_lock.exclusive():
+            self.recover()
+            for key in self.keys():
+                if key < cutoff and self._has_csv(key):
+                    self._compact_partition(key)
+                    compacted.append(key)
+        return compacted
+
+    def _compact_partition(self, key):
+        csv_path = self._csv_path(key)
+        with self._lock, self._append_lock.exclusive():
+            merged = os.path.getsize(csv_path)  # Appends are whole rows under this lock
+            previous = self._load_manifest()['segments'].get(key)
+
+        # Build the new compacted segment without holding up appends. The previous
+        # one is re-read as stored: its in-memory columns keep one name per UID
+        # and whole-second timestamps, so rebuilding from them would rewrite rows.
+        rows = [dict(zip(ATTENDANCE_FIELDS, values))
+                for values in _iter_compacted(self._path(previous['file']), previous['format'])] if previous else []
+        rows += _read_csv_prefix(csv_path, merged)
+        generation = previous['generation'] + 1 if previous else 1
+        name = f'{key}.{generation}'
+        data_file = f'{name}.{self.compact_format}'
+        stats_file = f'{name}.stats.json'
+        _write_compacted(self._path(data_file), self.compact_format, rows)
+
+        aggregates = DailyAggregates()
+        aggregates.apply(rows)
+        uid_rows, status_rows = {}, {}
+        for row in rows:
+            uid_rows[row['UID']] = uid_rows.get(row['UID'], 0) + 1
+            status_rows[row['Status']] = status_rows.get(row['Status'], 0) + 1
+        with atomic_write(self._path(stats_file)) as f:
+            json.dump({'by_uid': aggregates.by_uid, 'uid_rows': uid_rows, 'status_rows': status_rows}, f)
+
+        with self._manifest_lock.exclusive(), self._lock:
+            # The manifest write is the commit point; csv_merged lets a crash
+            # before the CSV cleanup below be finished by recover()
+            self._load_manifest()['segments'][key] = {
+                'file': data_file,
+                'format': self.compact_format,
+                'generation': generation,
+                'rows': len(rows),
+                'by_date': aggregates.by_date,
+                'stats': stats_file,
+                'csv_merged': merged,
+            }
+            self._save_manifest()
+            _drop_csv_prefix(csv_path, merged, self._append_lock)  # Keeps rows appended while compacting
+            del self._manifest['segments'][key]['csv_merged']
+            self._save_manifest()
+            self._segments.pop(key, None)
+            if previous:
+                self._cache.pop(previous['file'], None)
+                for old in (previous['file'], previous['stats']):
+                    try:
+                        os.remove(self._path(old))
+                    except FileNotFoundError:
+                        pass
+
+    def import_rows(self, rows, batch_size=10000):
+        """Append rows from another log (e.g. the legacy single file) in batches"""
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self.append(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.append(batch)
+            count += len(batch)
+        return count
+
+    # ---- Reads ----
+
+    def iter_rows(self):
+        for key in self.keys():
+            yield from self._partition_rows(key)
+
+    def _partition_query(self, key, date, status, uid):
+        """Return the matching rows of a partition, as of one manifest state"""
+        if not (status or uid) and (not date or key.startswith(date)):
+            return self._partition_rows(key)
+        with self._manifest_lock.shared():
+            numbers, fetch = self._selection(key, date, status, uid)
+            return fetch(numbers)
+
+    def query(self, date=None, status=None, uid=None):
+        return [row for key in self._matching_keys(date) for row in self._partition_query(key, date, status, uid)]
+
+    def iter_chunks(self, size, date=None, uid=None):
+        chunk = []
+        for key in self._matching_keys(date):
+            for row in self._partition_query(key, date, None, uid):
+                chunk.append(row)
+                if len(chunk) >= size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def tail(self, n):
+        rows = []
+        for key in reversed(self.keys()):
+            if len(rows) >= n:
+                break
+            if self._has_csv(key):
+                rows = self._segment(key).tail(n - len(rows)) + rows
+            if len(rows) < n:
+                compacted = self._compacted_columns(key)
+                rows = compacted.rows(range(max(len(compacted) - (n - len(rows)), 0), len(compacted))) + rows
+        return rows
+
+    def changes_since(self, position=None):
+        # position maps each partition CSV to its followed (inode, offset). Late
+        # rows for earlier days (e.g. absences) land in those days' CSVs, so
+        # every open segment is followed, not only the newest one.
+        keys = [key for key in self.keys() if self._has_csv(key)]
+        if position is None:
+            return [], {key: self._segment(key).changes_since()[1] for key in keys}
+        rows, followed = [], {}
+        for key in keys:
+            segment = self._segment(key)
+            # A partition created since the last call is read from its start
+            start = position.get(key, (segment._stat()[0], 0))
+            new_rows, followed[key] = segment.changes_since(start)
+            rows.extend(new_rows)
+        return rows, followed
+
+    def present_uids(self, date):
+        present = set()
+        for key in self._matching_keys(date):
+            with self._manifest_lock.shared():
+                present |= self._compacted_columns(key).present_uids(date)
+                if self._has_csv(key):
+                    present |= self._segment(key).present_uids(date)
+        return present
+
+    def count_by_date(self, start, end, uid=None):
+        counts = {}
+
+        def add(bucket_date, present, absent):
+            bucket = counts.setdefault(bucket_date, {'present': 0, 'absent': 0})
+            bucket['present'] += present
+            bucket['absent'] += absent
+
+        segments = self._load_manifest()['segments']
+        for key in self._overlapping_keys(start, end):
+            if key in segments:
+                if uid:
+                    by_date = {
+                        day: uids[uid] for day, uids in self._compacted_stats(key)['by_uid'].items()
+                        if uid in uids
+                    }
+                else:
+                    by_date = segments[key]['by_date']
+                for day, (present, absent) in by_date.items():
+                    if start <= day <= end:
+                        add(day, present, absent)
+            if self._has_csv(key):
+                for day, bucket in self._segment(key).count_by_date(start, end, uid).items():
+                    add(day, bucket['present'], bucket['absent'])
+        return counts
+
+    def rebuild_aggregates(self):
+        with self._compact_lock, self._compaction_lock.exclusive():
+            self.recover()
+            for key in self.keys():
+                if key in self._load_manifest()['segments']:
+                    # Recompacting rewrites the segment's counts from its rows
+                    append_csv_rows(self._csv_path(key), ATTENDANCE_FIELDS, [], lock=self._append_lock)  # Header only
+                    self._compact_partition(key)
+                elif self._has_csv(key):
+                    self._segment(key).rebuild_aggregates()
+
+    def _ordinal(self, key):
+        return datetime.strptime(key if len(key) == 10 else key + '-01', '%Y-%m-%d').toordinal()
+
+    def _count(self, key, date, status, uid):
+        """Count matching rows in a partition, from the manifest where possible"""
+        meta = self._load_manifest()['segments'].get(key)
+        count = 0
+        if meta:
+            covered = not date or key.startswith(date)
+            if covered and not status and not uid:
+                count += meta['rows']
+            else:
+                count += self._compacted_columns(key, meta).count(date, status, uid)
+        if self._has_csv(key):
+            count += len(self._segment(key).select(date, status, uid))
+        return count
+
+    def _selection(self, key, date, status, uid):
+        """Return (sorted row numbers, fetch) for the matching rows of one partition
+
+        Compacted rows are numbered first, then rows of the partition's CSV.
+        """
+        compacted = self._compacted_columns(key)
+        size = len(compacted)
+        numbers = list(compacted.select(date, status, uid))
+        segment = None
+        if self._has_csv(key):
+            segment = self._segment(key)
+            numbers += [size + n for n in segment.select(date, status, uid)]
+
+        def fetch(selected):
+            from_csv = [n - size for n in selected if n >= size]
+            csv_rows = iter(segment.fetch(from_csv)) if from_csv else iter(())
+            compacted_rows = iter(compacted.rows([n for n in selected if n < size]))
+            return [next(compacted_rows) if n < size else next(csv_rows) for n in selected]
+
+        return numbers, fetch
+
+    def page(self, date=None, status=None, uid=None, order='desc', limit=50, offset=0, cursor=None):
+        # Cursors pack (partition ordinal, row number within the partition)
+        descending = order != 'asc'
+        partitions = [(key, self._count(key, date, status, uid)) for key in self._matching_keys(date)]
+        total = sum(count for _, count in partitions)
+        if descending:
+            partitions.reverse()
+
+        rows, cursors = [], []
+        skip = offset if cursor is None else 0
+        more = False
+        for key, count in partitions:
+            if count == 0:
+                continue
+            if len(rows) >= limit:
+                more = True
+                break
+            ordinal = self._ordinal(key)
+            if cursor is not None:
+                if (ordinal > cursor >> 32) if descending else (ordinal < cursor >> 32):
+                    continue
+            elif skip >= count:
+                skip -= count
+                continue
+
+            numbers, fetch = self._selection(key, date, status, uid)
+            if descending:
+                numbers = numbers[::-1]
+            if cursor is not None and ordinal == cursor >> 32:
+                local = cursor & 0xFFFFFFFF
+                numbers = [n for n in numbers if (n < local if descending else n > local)]
+            numbers = numbers[skip:]
+            skip = 0
+            taken = numbers[:limit - len(rows)]
+            rows.extend(fetch(taken))
+            cursors.extend((ordinal << 32) | n for n in taken)
+            if len(taken) < len(numbers):
+                more = True
+                break
+
+        return {
+            'rows': rows,
+            'total': total,
+            'next_cursor': cursors[-1] if more and cursors else None,
+        }
+
+
+class CSVAdminRepository(AdminRepository):
+    """Admins file cached in memory, reloaded when its mtime or size changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._admins = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        with self._lock:
+            if signature != self._signature:
+                admins = {}
+                if signature is not None:
+                    with open(self.path, 'r', newline='') as f:
+                        for row in csv.DictReader(f):
+                            admins[row['Username']] = row['PasswordHash']
+                self._admins, self._signature = admins, signature
+            return self._admins
+
+    def all(self):
+        return dict(self._load())
+
+    def get(self, username):
+        return self._load().get(username)
+
+    def add(self, username, password_hash):
+        with self._lock:
+            append_csv_rows(self.path, ADMIN_FIELDS, [{'Username': username, 'PasswordHash': password_hash}])
+            self._signature = None  # Reload on next read, even within the mtime granularity
+
+
+class CSVStorage:
+    """CSV files under DATABASE_DIR (the original storage format).
+
+    The attendance log is partitioned into ATTENDANCE_DIR by day or month
+    (ATTENDANCE_PARTITION), or kept in the single ATTENDANCE_FILE when
+    ATTENDANCE_PARTITION is None.
+    """
+    name = 'csv'
+
+    def __init__(self, config):
+        self.config = config
+        self.students = CSVStudentRepository(config['STUDENTS_FILE'])
+        if config.get('ATTENDANCE_PARTITION'):
+            self.attendance = PartitionedAttendanceRepository(
+                config['ATTENDANCE_DIR'],
+                partition=config['ATTENDANCE_PARTITION'],
+                compact_after_days=config.get('ATTENDANCE_COMPACT_AFTER_DAYS', 7),
+                compact_format=config.get('ATTENDANCE_COMPACT_FORMAT'))
+        else:
+            self.attendance = CSVAttendanceRepository(
+                config['ATTENDANCE_FILE'], config['ATTENDANCE_STATS_FILE'])
+        self.admins = CSVAdminRepository(config['ADMINS_FILE'])
+
+    def init(self):
+        """Create the database files with headers if they don't exist"""
+        os.makedirs(self.config['DATABASE_DIR'], exist_ok=True)
+        files = [
+            (self.config['STUDENTS_FILE'], STUDENT_FIELDS),
+            (self.config['ADMINS_FILE'], ADMIN_FIELDS),
+        ]
+        if isinstance(self.attendance, PartitionedAttendanceRepository):
+            os.makedirs(self.config['ATTENDANCE_DIR'], exist_ok=True)
+            self.attendance.recover()
+            self._import_legacy_attendance()
+        else:
+            files.append((self.config['ATTENDANCE_FILE'], ATTENDANCE_FIELDS))
+        for path, fields in files:
+            try:
+                with open(path, 'x', newline='') as f:  # Never truncates a file another worker created
+                    csv.writer(f).writerow(fields)
+            except FileExistsError:
+                pass
+
+    def after_fork(self):
+        """Nothing to reset: files are opened per operation"""
+
+    def _import_legacy_attendance(self):
+        """Split an existing single-file attendance log into partitions, once"""
+        legacy = self.config['ATTENDANCE_FILE']
+        with FileLock(legacy).exclusive():
+            # Checked under the lock so only the first worker to start imports
+            if not os.path.exists(legacy) or self.attendance.keys():
+                return
+            with open(legacy, 'r', newline='') as f:
+                count = self.attendance.import_rows(csv.DictReader(f))
+            os.replace(legacy, legacy + '.migrated')
+        self.attendance.compact()
+        logger.info("Moved %d attendance rows from %s into %s", count, legacy, self.config['ATTENDANCE_DIR'])
+
+# ======================
+# SQLite Backend
+# ======================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    uid TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    registered_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attendance_uid ON attendance (uid);
+CREATE INDEX IF NOT EXISTS attendance_date_status ON attendance (date, status);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    date TEXT PRIMARY KEY,
+    present INTEGER NOT NULL DEFAULT 0,
+    absent INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS daily_uid_stats (
+    date TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    present INTEGER NOT NULL DEFAULT 0,
+    absent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, uid)
+);
+CREATE TRIGGER IF NOT EXISTS attendance_daily_stats AFTER INSERT ON attendance
+WHEN NEW.status = 'Present' OR instr(NEW.status, 'Absent') > 0
+BEGIN
+    INSERT INTO daily_stats (date, present, absent)
+    VALUES (NEW.date, NEW.status = 'Present', NEW.status != 'Present')
+    ON CONFLICT (date) DO UPDATE SET
+        present = present + excluded.present,
+        absent = absent + excluded.absent;
+    INSERT INTO daily_uid_stats (date, uid, present, absent)
+    VALUES (NEW.date, NEW.uid, NEW.status = 'Present', NEW.status != 'Present')
+    ON CONFLICT (date, uid) DO UPDATE SET
+        present = present + excluded.present,
+        absent = absent + excluded.absent;
+END;
+CREATE TABLE IF NOT EXISTS admins (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL
+);
+"""
+
+# Statements are module constants so each connection's statement cache
+# (sqlite3 keys it on the SQL text) reuses the prepared form.
+SQL_STUDENT_GET = "SELECT uid, name, email, registered_date FROM students WHERE uid = ?"
+SQL_STUDENT_ALL = "SELECT uid, name, email, registered_date FROM students ORDER BY rowid"
+SQL_STUDENT_UIDS = "SELECT uid FROM students"
+SQL_STUDENT_COUNT = "SELECT COUNT(*) FROM students"
+SQL_STUDENT_ADD = "INSERT OR IGNORE INTO students (uid, name, email, registered_date) VALUES (?, ?, ?, ?)"
+SQL_STUDENT_DELETE = "DELETE FROM students WHERE uid = ?"
+SQL_ATTENDANCE_ADD = "INSERT INTO attendance (uid, name, timestamp, date, status) VALUES (?, ?, ?, ?, ?)"
+SQL_ATTENDANCE_COLUMNS = "SELECT uid, name, timestamp, status FROM attendance"
+SQL_ATTENDANCE_TAIL = SQL_ATTENDANCE_COLUMNS + " ORDER BY id DESC LIMIT ?"
+SQL_ATTENDANCE_SINCE = "SELECT id, uid, name, timestamp, status FROM attendance WHERE id > ? ORDER BY id"
+SQL_ATTENDANCE_LAST_ID = "SELECT COALESCE(MAX(id), 0) FROM attendance"
+SQL_ATTENDANCE_PRESENT = "SELECT DISTINCT uid FROM attendance WHERE date = ? AND status = 'Present'"
+SQL_DAILY_COUNTS = "SELECT date, present, absent FROM daily_stats WHERE date BETWEEN ? AND ?"
+SQL_DAILY_UID_COUNTS = (
+    "SELECT date, present, absent FROM daily_uid_stats WHERE uid = ? AND date BETWEEN ? AND ?"
+)
+SQL_REBUILD_AGGREGATES = """
+DELETE FROM daily_stats;
+DELETE FROM daily_uid_stats;
+INSERT INTO daily_stats (date, present, absent)
+SELECT date, SUM(status = 'Present'), SUM(status != 'Present') FROM attendance
+WHERE status = 'Present' OR instr(status, 'Absent') > 0 GROUP BY date;
+INSERT INTO daily_uid_stats (date, uid, present, absent)
+SELECT date, uid, SUM(status = 'Present'), SUM(status != 'Present') FROM attendance
+WHERE status = 'Present' OR instr(status, 'Absent') > 0 GROUP BY date, uid;
+"""
+SQL_ADMIN_ALL = "SELECT username, password_hash FROM admins"
+SQL_ADMIN_GET = "SELECT password_hash FROM admins WHERE username = ?"
+SQL_ADMIN_ADD = "INSERT INTO admins (username, password_hash) VALUES (?, ?)"
+
+STUDENT_COLUMNS = {'Name': 'name', 'Email': 'email', 'RegisteredDate': 'registered_date'}
+
+
+def _student_row(values):
+    return dict(zip(STUDENT_FIELDS, values))
+
+
+def _attendance_row(values):
+    return dict(zip(ATTENDANCE_FIELDS, values))
+
+
+class SQLiteStudentRepository(StudentRepository):
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, uid):
+        row = self.storage.connection().execute(SQL_STUDENT_GET, (uid,)).fetchone()
+        return _student_row(row) if row else None
+
+    def all(self):
+        return [_student_row(row) for row in self.storage.connection().execute(SQL_STUDENT_ALL)]
+
+    def uids(self):
+        return {row[0] for row in self.storage.connection().execute(SQL_STUDENT_UIDS)}
+
+    def count(self):
+        return self.storage.connection().execute(SQL_STUDENT_COUNT).fetchone()[0]
+
+    def add(self, uid, name, email, registered_date):
+        conn = self.storage.connection()
+        with conn:
+            cursor = conn.execute(SQL_STUDENT_ADD, (uid, name, email, str(registered_date)))
+        return cursor.rowcount == 1
+
+    def update(self, uid, **fields):
+        columns = [STUDENT_COLUMNS[field] for field in fields]
+        sql = "UPDATE students SET {} WHERE uid = ?".format(
+            ', '.join(f"{column} = ?" for column in columns))
+        conn = self.storage.connection()
+        with conn:
+            cursor = conn.execute(sql, (*fields.values(), uid))
+        return cursor.rowcount == 1
+
+    def delete(self, uid):
+        conn = self.storage.connection()
+        with conn:
+            cursor = conn.execute(SQL_STUDENT_DELETE, (uid,))
+        return cursor.rowcount == 1
+
+    # Bulk operations run in one transaction: all of it is applied or none
+
+    def add_many(self, rows):
+        conn = self.storage.connection()
+        skipped = []
+        with conn:
+            for row in rows:
+                cursor = conn.execute(SQL_STUDENT_ADD, (
+                    row['UID'], row['Name'], row['Email'], str(row['RegisteredDate'])))
+                if cursor.rowcount != 1:
+                    skipped.append(row['UID'])
+        return skipped
+
+    def update_many(self, updates):
+        conn = self.storage.connection()
+        missing = []
+        with conn:
+            for uid, fields in updates.items():
+                sql = "UPDATE students SET {} WHERE uid = ?".format(
+                    ', '.join(f"{STUDENT_COLUMNS[field]} = ?" for field in fields))
+                if conn.execute(sql, (*fields.values(), uid)).rowcount != 1:
+                    missing.append(uid)
+        return missing
+
+    def delete_many(self, uids):
+        conn = self.storage.connection()
+        missing = []
+        with conn:
+            for uid in uids:
+                if conn.execute(SQL_STUDENT_DELETE, (uid,)).rowcount != 1:
+                    missing.append(uid)
+        return missing
+
+
+class SQLiteAttendanceRepository(AttendanceRepository):
+    def __init__(self, storage):
+        self.storage = storage
+
+    def append(self, rows, fsync=False):
+        conn = self.storage.connection()
+        if fsync:
+            # WAL with synchronous=NORMAL only syncs at checkpoints
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            with conn:
+                conn.executemany(SQL_ATTENDANCE_ADD, [
+                    (row['UID'], row['Name'], row['Timestamp'], row['Timestamp'][:10], row['Status'])
+                    for row in rows
+                ])
+        finally:
+            if fsync:
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+    def changes_since(self, position=None):
+        conn = self.storage.connection()
+        if position is None:
+            return [], conn.execute(SQL_ATTENDANCE_LAST_ID).fetchone()[0]
+        rows = conn.execute(SQL_ATTENDANCE_SINCE, (position,)).fetchall()
+        if not rows:
+            return [], position
+        return [_attendance_row(row[1:]) for row in rows], rows[-1][0]
+
+    def iter_rows(self):
+        cursor = self.storage.connection().execute(SQL_ATTENDANCE_COLUMNS + " ORDER BY id")
+        for row in cursor:
+            yield _attendance_row(row)
+
+    def _select(self, date=None, status=None, uid=None):
+        clauses, params = [], []
+        for column, value in [('date', date), ('status', status), ('uid', uid)]:
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = SQL_ATTENDANCE_COLUMNS
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return self.storage.connection().execute(sql + " ORDER BY id", params)
+
+    def query(self, date=None, status=None, uid=None):
+        return [_attendance_row(row) for row in self._select(date, status, uid)]
+
+    def page(self, date=None, status=None, uid=None, order='desc', limit=50, offset=0, cursor=None):
+        clauses, params = [], []
+        for column, value in [('date', date), ('status', status), ('uid', uid)]:
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        conn = self.storage.connection()
+        total = conn.execute("SELECT COUNT(*) FROM attendance" + where, params).fetchone()[0]
+
+        direction = 'ASC' if order == 'asc' else 'DESC'
+        if cursor is not None:
+            # Keyset pagination on the primary key: no rows are skipped over
+            clauses.append("id > ?" if order == 'asc' else "id < ?")
+            params.append(cursor)
+            where = " WHERE " + " AND ".join(clauses)
+            sql = f"SELECT id, uid, name, timestamp, status FROM attendance{where} ORDER BY id {direction} LIMIT ?"
+            params.append(limit + 1)
+        else:
+            sql = f"SELECT id, uid, name, timestamp, status FROM attendance{where} ORDER BY id {direction} LIMIT ? OFFSET ?"
+            params.extend([limit + 1, offset])
+        rows = conn.execute(sql, params).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'rows': [_attendance_row(row[1:]) for row in rows],
+            'total': total,
+            'next_cursor': rows[-1][0] if more and rows else None,
+        }
+
+    def iter_chunks(self, size, date=None, uid=None):
+        cursor = self._select(date=date, uid=uid)
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            yield [_attendance_row(row) for row in rows]
+
+    def tail(self, n):
+        rows = self.storage.connection().execute(SQL_ATTENDANCE_TAIL, (n,)).fetchall()
+        return [_attendance_row(row) for row in reversed(rows)]
+
+    def present_uids(self, date):
+        return {row[0] for row in self.storage.connection().execute(SQL_ATTENDANCE_PRESENT, (date,))}
+
+    def count_by_date(self, start, end, uid=None):
+        conn = self.storage.connection()
+        if uid:
+            cursor = conn.execute(SQL_DAILY_UID_COUNTS, (uid, start, end))
+        else:
+            cursor = conn.execute(SQL_DAILY_COUNTS, (start, end))
+        return {date: {'present': present, 'absent': absent} for date, present, absent in cursor}
+
+    def rebuild_aggregates(self):
+        self.storage.connection().executescript("BEGIN;" + SQL_REBUILD_AGGREGATES + "COMMIT;")
+
+
+class SQLiteAdminRepository(AdminRepository):
+    def __init__(self, storage):
+        self.storage = storage
+
+    def all(self):
+        return dict(self.storage.connection().execute(SQL_ADMIN_ALL).fetchall())
+
+    def get(self, username):
+        row = self.storage.connection().execute(SQL_ADMIN_GET, (username,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, username, password_hash):
+        conn = self.storage.connection()
+        with conn:
+            conn.execute(SQL_ADMIN_ADD, (username, password_hash))
+
+
+class SQLiteStorage:
+    """Single SQLite database in WAL mode, one connection per thread."""
+    name = 'sqlite'
+
+    def __init__(self, config):
+        self.config = config
+        self.path = config['SQLITE_FILE']
+        self._local = threading.local()
+        self.students = SQLiteStudentRepository(self)
+        self.attendance = SQLiteAttendanceRepository(self)
+        self.admins = SQLiteAdminRepository(self)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """Drop connections inherited from the parent; SQLite handles can't cross a fork"""
+        self._local = threading.local()
+
+    def init(self):
+        """Create the database file and schema if they don't exist"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = self.connection()
+        conn.executescript(SQLITE_SCHEMA)
+
+        # Databases created before the aggregate tables existed need a backfill
+        has_rows = conn.execute("SELECT 1 FROM attendance LIMIT 1").fetchone()
+        has_stats = conn.execute("SELECT 1 FROM daily_stats LIMIT 1").fetchone()
+        if has_rows and not has_stats:
+            self.attendance.rebuild_aggregates()
+
+# ======================
+# Backend Selection
+# ======================
+BACKENDS = {
+    CSVStorage.name: CSVStorage,
+    SQLiteStorage.name: SQLiteStorage,
+}
+
+
+def open_storage(config):
+    """Return the storage backend named by config['STORAGE_BACKEND']"""
+    backend = config.get('STORAGE_BACKEND', 'csv')
+    try:
+        return BACKENDS[backend](config)
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def migrate(source, target, batch_size=10000):
+    """Copy every student, attendance row and admin from source into target.
+
+    Returns (students, attendance rows, admins) copied. Students and admins
+    already present in the target are skipped, and the attendance log is
+    only copied into an empty target so the command is safe to re-run.
+    """
+    target.init()
+
+    students = 0
+    for row in source.students.all():
+        if target.students.add(row['UID'], row['Name'], row['Email'], row['RegisteredDate']):
+            students += 1
+
+    attendance = 0
+    batch = []
+    rows = source.attendance.iter_rows() if not target.attendance.tail(1) else ()
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            target.attendance.append(batch)
+            attendance += len(batch)
+            batch = []
+    if batch:
+        target.attendance.append(batch)
+        attendance += len(batch)
+
+    admins = 0
+    existing = target.admins.all()
+    for username, password_hash in source.admins.all().items():
+        if username not in existing:
+            target.admins.add(username, password_hash)
+            admins += 1
+
+    return students, attendance, admins
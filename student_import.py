@@ -0,0 +1,110 @@
+import csv
+import io
+import re
+from datetime import datetime
+
+IMPORT_FORMATS = ('csv', 'xlsx')
+
+# Accepted spellings of each column header, compared lowercase without punctuation
+HEADER_ALIASES = {
+    'uid': 'UID',
+    'rfid': 'UID',
+    'rfiduid': 'UID',
+    'name': 'Name',
+    'fullname': 'Name',
+    'email': 'Email',
+    'registereddate': 'RegisteredDate',
+    'registered': 'RegisteredDate',
+}
+
+
+def _header(name):
+    return HEADER_ALIASES.get(re.sub(r'[^a-z]', '', str(name).lower()))
+
+
+def read_students(stream, file_format):
+    """Yield (row_number, row) for each student in an uploaded CSV or XLSX file
+
+    Row numbers are as a spreadsheet shows them (the header is row 1).
+    Unknown columns are ignored.
+    """
+    if file_format == 'xlsx':
+        import pandas as pd  # Only needed for spreadsheets
+        frame = pd.read_excel(stream, dtype=str, keep_default_na=False)
+        columns = [(column, _header(column)) for column in frame.columns]
+        records = frame.itertuples(index=False, name=None)
+        records = (dict(zip(frame.columns, values)) for values in records)
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        columns = [(column, _header(column)) for column in reader.fieldnames or []]
+        records = reader
+    for number, record in enumerate(records, start=2):
+        yield number, {field: str(record[column] or '').strip() for column, field in columns if field}
+
+
+def validate_students(records, registered, today, update=False):
+    """Check imported rows in one pass against the set of registered UIDs
+
+    Returns (new_rows, updates, errors). With update=True a row whose UID
+    is already registered updates its name and email instead of being an
+    error. Each error is {"row", "uid", "error"}.
+    """
+    new_rows, updates, errors = [], {}, []
+    seen = set()
+    for number, row in records:
+        uid = row.get('UID', '')
+        problem = None
+        if not uid or any(c.isspace() for c in uid):
+            problem = 'missing or invalid UID'
+        elif uid in seen:
+            problem = 'UID repeated in the file'
+        elif not row.get('Name'):
+            problem = 'missing name'
+        elif '@' not in row.get('Email', ''):
+            problem = 'missing or invalid email'
+        elif uid in registered and not update:
+            problem = 'already registered'
+        if problem is None and row.get('RegisteredDate'):
+            try:
+                datetime.strptime(row['RegisteredDate'][:10], '%Y-%m-%d')
+            except ValueError:
+                problem = 'registered date is not YYYY-MM-DD'
+        if problem:
+            errors.append({'row': number, 'uid': uid, 'error': problem})
+            continue
+        seen.add(uid)
+        if uid in registered:
+            updates[uid] = {'Name': row['Name'], 'Email': row['Email']}
+        else:
+            new_rows.append({
+                'UID': uid,
+                'Name': row['Name'],
+                'Email': row['Email'],
+                'RegisteredDate': row.get('RegisteredDate', '')[:10] or str(today),
+            })
+    return new_rows, updates, errors
+
+
+def import_students(repository, stream, file_format, today, update=False, dry_run=False):
+    """Validate an uploaded roster and apply it with one bulk add (and one bulk update)
+
+    Returns a report: {"imported", "updated", "errors"}. Nothing is written
+    on a dry run.
+    """
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {file_format}")
+    new_rows, updates, errors = validate_students(
+        read_students(stream, file_format), repository.uids(), today, update)
+    if dry_run:
+        return {'imported': len(new_rows), 'updated': len(updates), 'errors': errors}
+
+    # Rows registered by someone else since validation are reported, not overwritten
+    skipped = set(repository.add_many(new_rows)) if new_rows else set()
+    missing = set(repository.update_many(updates)) if updates else set()
+    errors += [{'row': None, 'uid': uid, 'error': 'already registered'} for uid in sorted(skipped)]
+    errors += [{'row': None, 'uid': uid, 'error': 'no longer registered'} for uid in sorted(missing)]
+    return {
+        'imported': len(new_rows) - len(skipped),
+        'updated': len(updates) - len(missing),
+        'errors': errors,
+    }
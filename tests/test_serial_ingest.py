@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from serial_ingest import SerialIngestor
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs a pseudo-terminal')
+
+
+@pytest.fixture
+def fake_reader():
+    """A pty standing in for a reader: write firmware output to the fd, open the path as the port"""
+    import pty
+    import tty
+
+    controller, device = pty.openpty()
+    tty.setraw(device)  # No echo or newline translation, like a USB serial port
+    path = os.ttyname(device)
+    yield controller, path
+    os.close(controller)
+    os.close(device)
+
+
+def start_ingestor(path, **options):
+    batches = []
+    received = threading.Condition()
+
+    def handle_batch(batch):
+        with received:
+            batches.append(batch)
+            received.notify_all()
+
+    ingestor = SerialIngestor([path], handle_batch, batch_ms=50, reconnect_delay=0.1, **options)
+    ingestor.start()
+
+    def wait_for(count, timeout=5):
+        with received:
+            received.wait_for(lambda: sum(map(len, batches)) >= count, timeout)
+        return [tap for batch in batches for tap in batch]
+
+    return ingestor, wait_for
+
+
+def wait_connected(ingestor, path, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not ingestor.stats()['ports'][path]['connected']:
+        assert time.monotonic() < deadline, 'port never opened'
+        time.sleep(0.01)
+
+
+def test_parses_uid_lines_and_ignores_boot_output(fake_reader):
+    controller, path = fake_reader
+    ingestor, wait_for = start_ingestor(path)
+    try:
+        wait_connected(ingestor, path)
+        os.write(controller, b'ets Jun  8 2016 00:22:57\r\nRFID reader ready\r\nUID: A1B2C3D4\r\nUID:0badf00d\n')
+        taps = wait_for(2)
+        assert [uid for uid, _ in taps] == ['A1B2C3D4', '0badf00d']
+        stats = ingestor.stats()
+        assert stats['ports'][path]['ignored_lines'] == 2
+        assert stats['ports'][path]['taps'] == 2
+    finally:
+        ingestor.stop()
+
+
+def test_joins_lines_split_across_reads(fake_reader):
+    controller, path = fake_reader
+    ingestor, wait_for = start_ingestor(path)
+    try:
+        wait_connected(ingestor, path)
+        os.write(controller, b'UID: DEAD')
+        time.sleep(0.2)
+        os.write(controller, b'BEEF\r\n')
+        assert [uid for uid, _ in wait_for(1)] == ['DEADBEEF']
+    finally:
+        ingestor.stop()
+
+
+def test_debounces_repeat_taps(fake_reader):
+    controller, path = fake_reader
+    ingestor, wait_for = start_ingestor(path, debounce=5.0)
+    try:
+        wait_connected(ingestor, path)
+        os.write(controller, b'UID: A1B2C3D4\r\nUID: A1B2C3D4\r\nUID: 11223344\r\nUID: A1B2C3D4\r\n')
+        wait_for(2)
+        time.sleep(0.3)  # Give any wrongly accepted repeat time to arrive
+        assert [uid for uid, _ in wait_for(2)] == ['A1B2C3D4', '11223344']
+        assert ingestor.stats()['ports'][path]['duplicates'] == 2
+    finally:
+        ingestor.stop()
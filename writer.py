@@ -0,0 +1,163 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('sync', 'group', 'async')
+
+_STOP = object()
+
+
+class AttendanceWriter:
+    """Write-behind queue in front of an attendance repository.
+
+    Durability modes:
+      'sync'  - rows are appended and fsynced on the caller's thread
+      'group' - a background thread commits queued rows in groups of up to
+                max_rows, or whatever arrived within max_delay_ms, with one
+                fsync per group
+      'async' - as 'group', but without the fsync
+
+    The queue is bounded; submit() raises queue.Full when it is, so callers
+    can push back on readers instead of growing memory without limit.
+    """
+
+    def __init__(self, repository, mode='group', max_rows=100, max_delay_ms=50, maxsize=10000):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        self.repository = repository
+        self.mode = mode
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._depth = 0       # Rows waiting in the queue
+        self._committed = 0   # Rows written since start
+        self._groups = 0      # Commits performed since start
+        self._errors = 0      # Failed commit attempts since start
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Call callback(rows) after every successful commit"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _notify(self, rows):
+        for callback in self._listeners:
+            try:
+                callback(rows)
+            except Exception:
+                logger.exception("Attendance commit listener failed")
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='attendance-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, rows):
+        """Queue rows for writing (or write them now in 'sync' mode)"""
+        if not rows:
+            return
+        if self.mode == 'sync':
+            self.repository.append(rows, fsync=True)
+            with self._lock:
+                self._committed += len(rows)
+                self._groups += 1
+            self._notify(rows)
+            return
+
+        self.start()
+        with self._lock:
+            self._depth += len(rows)
+        try:
+            self._queue.put_nowait(list(rows))
+        except queue.Full:
+            with self._lock:
+                self._depth -= len(rows)
+            raise
+
+    def flush(self):
+        """Block until every row queued so far has been committed"""
+        if self.mode != 'sync' and self._thread is not None:
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """Drain the queue, commit what is left and stop the writer thread"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def depth(self):
+        return self._depth
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'queue_depth': self._depth,
+                'committed_rows': self._committed,
+                'commits': self._groups,
+                'errors': self._errors,
+            }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            group = [item]
+            rows = len(item)
+            deadline = time.monotonic() + self.max_delay
+            while rows < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                group.append(item)
+                rows += len(item)
+
+            self._commit([row for item in group for row in item], retry=not stopping)
+            for _ in group:
+                self._queue.task_done()
+
+    def _commit(self, rows, retry=True):
+        committed = False
+        while not committed:
+            try:
+                self.repository.append(rows, fsync=self.mode == 'group')
+                committed = True
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                if not retry:
+                    logger.exception("Dropping %d attendance rows after failed final commit", len(rows))
+                    break
+                # Keep the rows and retry; the bounded queue pushes back on readers meanwhile
+                logger.exception("Attendance commit failed, retrying %d rows", len(rows))
+                time.sleep(1)
+
+        with self._lock:
+            self._depth -= len(rows)
+            if committed:
+                self._committed += len(rows)
+                self._groups += 1
+        if committed:
+            self._notify(rows)
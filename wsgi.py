@@ -0,0 +1,14 @@
+"""WSGI entry point for serving with several worker processes.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is created once in the gunicorn master (preload_app), so the
+roster and indexes are loaded once and shared copy-on-write by the
+workers. The warm-up runs before create_app() returns, since a thread
+still loading in the master would not survive the fork. Each worker then
+resets its per-process state in post_fork, and exactly one of them takes
+ownership of the serial reader.
+"""
+from server import create_app
+
+app = create_app({'WARM_UP': 'eager'})